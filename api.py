@@ -1,10 +1,44 @@
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi import HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from pydantic import Field
+from typing import Dict
 from typing import List
-from srv.ebook_services import query_database
+from typing import Optional
+from db.db_methods import HNSW_MAX_EF_SEARCH
+from db.pool import close_pool
+from srv.async_services import query_database_async
+from srv.async_services import query_database_batch_async
+from srv.async_services import shutdown_executors
+from srv.async_services import stream_query_database_async
+from srv.ebook_services import context_cache_stats
+from srv.ebook_services import document_encoder_stats
+from srv.ebook_services import encoder_stats
+from srv.ebook_services import query_cache_stats
+from srv.ebook_services import result_cache_stats
+from srv.ebook_services import warm_model
 
-app = FastAPI()
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "1000"))
+# Results per query; an HNSW scan returns at most 1000 rows
+MAX_NUM_RESULTS = int(os.getenv("MAX_NUM_RESULTS", "100"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the model once at startup instead of on the first search
+    warm_model()
+    yield
+    shutdown_executors()
+    close_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -17,22 +51,85 @@ app.add_middleware(
 
 class Query(BaseModel):
     text: str
-    num_results: int = 5
+    num_results: int = Field(5, ge=1, le=MAX_NUM_RESULTS)
     books: bool = False
+    extended: bool = False
+    # Higher values search more of the index, trading latency for recall; None uses the server defaults
+    ef_search: Optional[int] = Field(None, ge=1, le=HNSW_MAX_EF_SEARCH)
+    probes: Optional[int] = Field(None, ge=1)
 
 class SearchResult(BaseModel):
     title: str
     text: str
     similarity: float
 
-# Replace this with your actual vector database interaction code
-async def query_vector_db(text: str, num_results: int, books: bool) -> List[SearchResult]:
-    # Add your vector database query logic here
-    # Example return format:
-    return query_database(text, num_results, False, books)
+class BatchQuery(BaseModel):
+    texts: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_QUERIES)
+    num_results: int = Field(5, ge=1, le=MAX_NUM_RESULTS)
+    books: bool = False
+    ef_search: Optional[int] = Field(None, ge=1, le=HNSW_MAX_EF_SEARCH)
+    probes: Optional[int] = Field(None, ge=1)
+
+class BatchSearchResult(BaseModel):
+    text: str
+    results: List[SearchResult]
+
+async def query_vector_db(
+    text: str,
+    num_results: int,
+    books: bool,
+    extended: bool = False,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+) -> List[SearchResult]:
+    # Encoding and the database lookup run off the event loop, bounded by SEARCH_TIMEOUT
+    try:
+        return await query_database_async(text, num_results, books, extended, ef_search=ef_search, probes=probes)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Search timed out")
 
 
 @app.post("/api/search", response_model=List[SearchResult])
 async def search(query: Query):
-    results = await query_vector_db(query.text, query.num_results, query.books)
-    return results
\ No newline at end of file
+    results = await query_vector_db(query.text, query.num_results, query.books, query.extended, query.ef_search, query.probes)
+    return results
+
+
+@app.post("/api/search/stream")
+async def search_stream(query: Query):
+    # Newline-delimited JSON, one SearchResult per line, sent as soon as each result is resolved
+    try:
+        results = await stream_query_database_async(
+            query.text, query.num_results, query.books, query.extended, ef_search=query.ef_search, probes=query.probes
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Search timed out")
+
+    async def lines():
+        async for result in results:
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.post("/api/search/batch", response_model=List[BatchSearchResult])
+async def search_batch(query: BatchQuery):
+    # All queries are encoded together and looked up in one database round trip
+    try:
+        results = await query_database_batch_async(
+            query.texts, query.num_results, query.books, ef_search=query.ef_search, probes=query.probes
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Batch search timed out")
+    return [{"text": text, "results": text_results} for text, text_results in zip(query.texts, results)]
+
+
+@app.get("/api/stats")
+async def stats() -> Dict:
+    return {
+        "encoder": encoder_stats(),
+        "query_cache": query_cache_stats(),
+        "result_cache": result_cache_stats(),
+        "context_cache": context_cache_stats(),
+        "document_encoder": document_encoder_stats(),
+    }
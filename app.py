@@ -1,4 +1,5 @@
 # app.py
+import json
 import streamlit as st
 from typing import List
 import requests
@@ -9,29 +10,34 @@ st.title("Ebook Vector Search")
 query = st.text_input("Enter your search query:")
 num_results = st.slider("Number of results", min_value=1, max_value=10, value=5)
 search_type = st.radio("Search for:", ("Chunks of Text", "Books"))
+extended = st.checkbox("Show surrounding text", value=False, disabled=search_type == "Books")
 
 if st.button("Search"):
     if query:
         with st.spinner("Searching..."):
             try:
+                # Results arrive one JSON object per line and are rendered as soon as each is read
                 response = requests.post(
-                    "http://localhost:8000/api/search",
-                    json={"text": query, "num_results": num_results, "books": search_type == "Books"}
+                    "http://localhost:8000/api/search/stream",
+                    json={
+                        "text": query,
+                        "num_results": num_results,
+                        "books": search_type == "Books",
+                        "extended": extended and search_type != "Books",
+                    },
+                    stream=True,
                 )
-                results = response.json()
-                
-                if search_type == "Books":
-                    for i, result in enumerate(results, 1):
-                        with st.container():
-                            st.markdown(f"### Result {i}")
-                            st.markdown(f"**Title:** {result['title']}")
-                            st.markdown(f"**Consine Similarity:** {result['similarity']:.2f}")
-                else:
-                    for i, result in enumerate(results, 1):
-                        with st.container():
-                            st.markdown(f"### Result {i}")
-                            st.markdown(f"**Title:** {result['title']}")
-                            st.markdown(f"**Consine Similarity:** {result['similarity']:.2f}")
+                response.raise_for_status()
+
+                for i, line in enumerate(response.iter_lines(), 1):
+                    if not line:
+                        continue
+                    result = json.loads(line)
+                    with st.container():
+                        st.markdown(f"### Result {i}")
+                        st.markdown(f"**Title:** {result['title']}")
+                        st.markdown(f"**Consine Similarity:** {result['similarity']:.2f}")
+                        if search_type != "Books":
                             st.markdown(f"**Text:** {result['text']}")
                             st.divider()
             except Exception as e:
@@ -45,5 +51,5 @@ with st.sidebar:
     st.markdown("""
     Configure your vector search settings here.
     
-    Current endpoint: `http://localhost:8000/api/search`
+    Current endpoint: `http://localhost:8000/api/search/stream`
     """)
\ No newline at end of file
@@ -0,0 +1,107 @@
+import argparse
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+from db.binary_copy import binary_pg_insert
+from db.binary_copy import encode_chunk_rows
+from db.db_methods import fast_pg_insert
+from db.db_methods import insert_book
+from db.pool import get_connection
+
+COLUMNS = ["book_title", "chunk_text", "chunk_number", "begin_offset", "embedding"]
+BENCH_TITLE = "__bench_copy__.txt"
+
+
+def _make_rows(rows, dimensions, chunk_length=500):
+    rng = np.random.default_rng(0)
+    alphabet = np.array(list("abcdefghijklmnopqrstuvwxyz     "))
+    chunks = ["".join(rng.choice(alphabet, chunk_length)) for _ in range(min(rows, 1000))]
+    chunks = [chunks[i % len(chunks)] for i in range(rows)]
+    embeddings = rng.standard_normal((rows, dimensions)).astype(np.float32)
+    offsets = [i * 450 for i in range(rows)]
+    return chunks, embeddings, offsets
+
+
+def _csv_frame(chunks, embeddings, offsets):
+    # The DataFrame the ingest path built before binary COPY
+    return pd.DataFrame(
+        {
+            "book_title": [BENCH_TITLE] * len(chunks),
+            "chunk_text": chunks,
+            "chunk_number": list(range(1, len(chunks) + 1)),
+            "begin_offset": offsets,
+            "embedding": [embedding.tolist() for embedding in embeddings],
+        }
+    )
+
+
+def _csv_serialize(chunks, embeddings, offsets):
+    buffer = io.StringIO()
+    _csv_frame(chunks, embeddings, offsets).to_csv(
+        buffer, sep="\t", index=False, header=False, escapechar="\\", doublequote=True, na_rep="\\N"
+    )
+    return buffer
+
+
+def _binary_serialize(chunks, embeddings, offsets):
+    return encode_chunk_rows(BENCH_TITLE, chunks, range(1, len(chunks) + 1), offsets, embeddings)
+
+
+def _time(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def _delete_bench_rows(book=False):
+    with get_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM book_embeddings WHERE book_title = %s;", (BENCH_TITLE,))
+            if book:
+                cursor.execute("DELETE FROM books WHERE title = %s;", (BENCH_TITLE,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare CSV and binary COPY for book_embeddings rows")
+    parser.add_argument("-n", "--rows", type=int, default=20000, help="Number of rows to serialize")
+    parser.add_argument("--dims", type=int, default=384, help="Embedding dimensions")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions per measurement, best time is reported")
+    parser.add_argument("--db", action="store_true", help="Also COPY the rows into the database")
+    args = parser.parse_args()
+
+    chunks, embeddings, offsets = _make_rows(args.rows, args.dims)
+    results = {
+        "csv serialize": _time(lambda: _csv_serialize(chunks, embeddings, offsets), args.repeat),
+        "binary serialize": _time(lambda: _binary_serialize(chunks, embeddings, offsets), args.repeat),
+    }
+
+    if args.db:
+        insert_book(BENCH_TITLE, "")
+        try:
+            results["csv copy"] = _time(
+                lambda: (fast_pg_insert(_csv_frame(chunks, embeddings, offsets), COLUMNS), _delete_bench_rows()),
+                args.repeat,
+            )
+            results["binary copy"] = _time(
+                lambda: (
+                    binary_pg_insert(BENCH_TITLE, chunks, range(1, len(chunks) + 1), offsets, embeddings),
+                    _delete_bench_rows(),
+                ),
+                args.repeat,
+            )
+        finally:
+            _delete_bench_rows(book=True)
+
+    print(f"{args.rows} rows x {args.dims} dims, best of {args.repeat}")
+    for name, seconds in results.items():
+        print(f"{name:>18}: {seconds:8.3f}s {args.rows / seconds:12.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from srv.chunkers import CHUNKER
+from srv.chunkers import CHUNKERS
+from srv.chunkers import get_chunker
+from srv.document_encoder import DOC_ENCODE_MAX_BATCH
+from srv.document_encoder import DOC_ENCODE_TOKEN_BUDGET
+from srv.document_encoder import _token_lengths
+from srv.document_encoder import encode_documents
+from srv.ebook_services import MODEL_NAME
+from srv.model_registry import get_model
+
+
+def _time(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def _text_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            yield from (os.path.join(path, file) for file in sorted(os.listdir(path)) if file.endswith(".txt"))
+        elif path.endswith(".txt"):
+            yield path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare token-budget document encoding with plain model.encode")
+    parser.add_argument("paths", nargs="+", help="Text files, or directories of them")
+    parser.add_argument("--model", default=MODEL_NAME, help="Embedding model")
+    parser.add_argument("--chunker", choices=CHUNKERS, default=CHUNKER, help="Chunker to split the texts with")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[32, 128], help="model.encode batch sizes")
+    parser.add_argument(
+        "--budgets", type=int, nargs="+", default=[DOC_ENCODE_TOKEN_BUDGET], help="encode_documents token budgets"
+    )
+    parser.add_argument("--max-chunks", type=int, default=5000, help="Chunks encoded per measurement")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions per measurement, best time is reported")
+    args = parser.parse_args()
+
+    paths = list(_text_paths(args.paths))
+    if not paths:
+        parser.error("No .txt files found")
+
+    model = get_model(args.model)
+    chunker = get_chunker(model, args.chunker)
+    chunks = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            chunks.extend(chunker.chunk(f.read())[0])
+    chunks = chunks[: args.max_chunks]
+    tokens = int(_token_lengths(model, chunks).sum())
+    print(f"{len(chunks)} chunks, {tokens} tokens, {args.chunker} chunker, {args.model}")
+
+    # Warm up so the first measurement does not pay for lazy initialisation
+    model.encode(chunks[:32], show_progress_bar=False)
+
+    print(f"{'method':<32} {'seconds':>8} {'tokens/s':>10} {'chunks/s':>9} {'max diff':>9}")
+    reference = None
+    for batch_size in args.batch_sizes:
+        seconds, embeddings = _time(
+            lambda: model.encode(chunks, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False),
+            args.repeat,
+        )
+        if reference is None:
+            reference = embeddings
+        label = f"model.encode batch={batch_size}"
+        diff = float(np.abs(embeddings - reference).max())
+        print(f"{label:<32} {seconds:8.2f} {tokens / seconds:10.0f} {len(chunks) / seconds:9.1f} {diff:9.2e}")
+    for budget in args.budgets:
+        seconds, embeddings = _time(
+            lambda: encode_documents(model, chunks, token_budget=budget, max_batch=DOC_ENCODE_MAX_BATCH), args.repeat
+        )
+        label = f"encode_documents budget={budget}"
+        diff = float(np.abs(embeddings - reference).max())
+        print(f"{label:<32} {seconds:8.2f} {tokens / seconds:10.0f} {len(chunks) / seconds:9.1f} {diff:9.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import os
+import time
+
+import ebooklib
+from bs4 import BeautifulSoup
+from ebooklib import epub
+
+from utils.epub2txt import EPUB_WORKERS
+from utils.epub2txt import epub_chapters
+
+
+def _legacy_epub_to_text(epub_path):
+    # The extraction used before lxml: every document in manifest order, parsed serially with html.parser
+    book = epub.read_epub(epub_path)
+    chapters = []
+    for item in book.get_items():
+        if item.get_type() == ebooklib.ITEM_DOCUMENT:
+            text = " ".join(BeautifulSoup(item.get_content(), "html.parser").get_text().split())
+            if text:
+                chapters.append(text)
+    return "\n\n".join(chapters)
+
+
+def _lxml_epub_to_text(epub_path, workers):
+    return "\n\n".join(chapter.text for chapter in epub_chapters(epub_path, workers))
+
+
+def _time(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def _word_overlap(a, b):
+    # Fraction of the legacy words also extracted by lxml, ignoring order
+    a_words, b_words = set(a.split()), set(b.split())
+    return len(a_words & b_words) / len(a_words) if a_words else 1.0
+
+
+def _epub_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            yield from (os.path.join(path, file) for file in sorted(os.listdir(path)) if file.endswith(".epub"))
+        elif path.endswith(".epub"):
+            yield path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare html.parser and lxml EPUB text extraction")
+    parser.add_argument("paths", nargs="+", help="EPUB files, or directories of them")
+    parser.add_argument("-w", "--workers", type=int, nargs="+", default=[1, EPUB_WORKERS], help="Parsing threads")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions per measurement, best time is reported")
+    args = parser.parse_args()
+
+    paths = list(_epub_paths(args.paths))
+    if not paths:
+        parser.error("No .epub files found")
+
+    header = f"{'book':<40} {'legacy':>10}" + "".join(f" {f'lxml w={w}':>10}" for w in args.workers)
+    print(header + f" {'speedup':>8} {'words':>6} {'chapters':>8}")
+    totals = [0.0] * (len(args.workers) + 1)
+    for path in paths:
+        legacy_seconds, legacy_text = _time(lambda: _legacy_epub_to_text(path), args.repeat)
+        times = [legacy_seconds]
+        for workers in args.workers:
+            seconds, text = _time(lambda: _lxml_epub_to_text(path, workers), args.repeat)
+            times.append(seconds)
+        chapters = len(epub_chapters(path, 1))
+        totals = [total + seconds for total, seconds in zip(totals, times)]
+        print(
+            f"{os.path.basename(path)[:40]:<40}"
+            + "".join(f" {seconds * 1000:8.1f}ms" for seconds in times)
+            + f" {legacy_seconds / min(times[1:]):7.1f}x {_word_overlap(legacy_text, text):6.1%} {chapters:8}"
+        )
+    print(
+        f"{'total':<40}" + "".join(f" {seconds * 1000:8.1f}ms" for seconds in totals) + f" {totals[0] / min(totals[1:]):7.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
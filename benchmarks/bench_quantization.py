@@ -0,0 +1,158 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from db.db_methods import QUANTIZED_INDEXES
+from db.embedding_matrix import EMBEDDING_MATRIX_PATH
+from db.pool import get_connection
+from db.quantization import QUANTIZATION_MODES
+from db.quantization import compact_scores
+from db.quantization import int8_scale
+from db.quantization import quantize
+from db.quantization import rescore
+from db.quantization import top_k
+
+
+def _normalize(matrix):
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=-1, keepdims=True), 1e-12)
+
+
+def _load_vectors(matrix_path, rows, dimensions):
+    embeddings_path = os.path.join(matrix_path, "embeddings.npy")
+    if os.path.exists(embeddings_path):
+        print(f"Using the exported embeddings in {matrix_path}")
+        return np.load(embeddings_path, mmap_mode="r")
+    # Clustered synthetic vectors, so neighbours are meaningful rather than uniformly far apart
+    print(f"No export at {matrix_path}, using {rows} synthetic vectors")
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((max(1, rows // 100), dimensions)).astype(np.float32)
+    vectors = centers[rng.integers(len(centers), size=rows)] + 0.5 * rng.standard_normal((rows, dimensions))
+    return _normalize(vectors.astype(np.float32))
+
+
+def _make_queries(vectors, count, seed=1):
+    rng = np.random.default_rng(seed)
+    queries = np.asarray(vectors[np.sort(rng.choice(len(vectors), count, replace=False))])
+    return _normalize(queries + 0.05 * rng.standard_normal(queries.shape).astype(np.float32))
+
+
+def _recall(found, truth):
+    return np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)])
+
+
+def bench_matrix(vectors, queries, k, factors):
+    """
+    Measure recall@k, latency and size of exact float32 search and of each quantized representation with rescoring.
+    """
+    truth = [top_k(np.asarray(vectors) @ query, k) for query in queries]
+    results = []
+    started = time.perf_counter()
+    for query in queries:
+        top_k(np.asarray(vectors) @ query, k)
+    results.append(("float32", "-", 1.0, (time.perf_counter() - started) / len(queries), vectors.nbytes))
+
+    for mode in QUANTIZATION_MODES:
+        scale = int8_scale(vectors) if mode == "int8" else None
+        compact = quantize(vectors, mode, scale)
+        for factor in factors:
+            found = []
+            started = time.perf_counter()
+            for query in queries:
+                candidates = top_k(compact_scores(compact, query, mode, scale), k * factor)
+                found.append(rescore(vectors, query, candidates, k)[0])
+            seconds = (time.perf_counter() - started) / len(queries)
+            results.append((mode, factor, _recall(found, truth), seconds, compact.nbytes))
+    return results
+
+
+def bench_pgvector(queries_count, k, factors):
+    """
+    Build an HNSW index per quantization mode over book_embeddings and measure recall@k, latency and index size
+    against an exact sequential scan. The indexes are dropped afterwards.
+    """
+    with get_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT embedding::real[] FROM book_embeddings ORDER BY random() LIMIT %s;", (queries_count,))
+            queries = [row[0] for row in cursor.fetchall()]
+            cursor.execute("SET LOCAL enable_indexscan = off;")
+            truth = []
+            for query in queries:
+                cursor.execute("SELECT id FROM book_embeddings ORDER BY embedding <=> %s::vector LIMIT %s;", (query, k))
+                truth.append([row[0] for row in cursor.fetchall()])
+
+    results = []
+    for mode in QUANTIZED_INDEXES:
+        expression, opclass, query_expression = QUANTIZED_INDEXES[mode]
+        operator = "<~>" if mode == "binary" else "<=>"
+        index_name = f"bench_{mode or 'vector'}_idx"
+        try:
+            with get_connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"CREATE INDEX {index_name} ON book_embeddings USING hnsw ({expression} {opclass});")
+                    cursor.execute("SELECT pg_relation_size(%s);", (index_name,))
+                    size = cursor.fetchone()[0]
+            for factor in factors:
+                found = []
+                started = time.perf_counter()
+                with get_connection() as connection:
+                    with connection.cursor() as cursor:
+                        cursor.execute("SET LOCAL hnsw.ef_search = %s;", (max(40, k * factor),))
+                        for query in queries:
+                            cursor.execute(
+                                f"""
+                                SELECT id FROM (
+                                    SELECT id, embedding <=> %(embedding)s::vector AS distance
+                                    FROM book_embeddings
+                                    ORDER BY {expression} {operator} {query_expression}
+                                    LIMIT %(candidates)s
+                                ) candidates
+                                ORDER BY distance
+                                LIMIT %(k)s;
+                                """,
+                                {"embedding": query, "candidates": k * factor, "k": k},
+                            )
+                            found.append([row[0] for row in cursor.fetchall()])
+                seconds = (time.perf_counter() - started) / len(queries)
+                results.append((mode or "vector", factor, _recall(found, truth), seconds, size))
+        finally:
+            with get_connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"DROP INDEX IF EXISTS {index_name};")
+    return results
+
+
+def _print_report(title, results):
+    print(title)
+    print(f"{'mode':>8} {'rescore':>7} {'recall':>7} {'ms/query':>9} {'size':>10}")
+    for mode, factor, recall, seconds, size in results:
+        print(f"{mode:>8} {factor!s:>7} {recall:7.3f} {seconds * 1000:9.2f} {size / 2**20:8.1f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare recall, latency and size of quantized embedding search")
+    parser.add_argument("--matrix", default=EMBEDDING_MATRIX_PATH, help="Exported embedding matrix to benchmark on")
+    parser.add_argument("-n", "--rows", type=int, default=100000, help="Synthetic rows when there is no export")
+    parser.add_argument("--dims", type=int, default=384, help="Synthetic embedding dimensions")
+    parser.add_argument("-q", "--queries", type=int, default=100, help="Number of queries")
+    parser.add_argument("-k", type=int, default=10, help="Results per query")
+    parser.add_argument("--factors", type=int, nargs="+", default=[1, 4, 10], help="Candidates rescored per result")
+    parser.add_argument("--db", action="store_true", help="Also benchmark pgvector indexes on book_embeddings")
+    args = parser.parse_args()
+
+    vectors = _load_vectors(args.matrix, args.rows, args.dims)
+    queries = _make_queries(vectors, min(args.queries, len(vectors)))
+    _print_report(
+        f"NumPy, {len(vectors)} x {vectors.shape[1]}, recall@{args.k} against exact float32 search",
+        bench_matrix(vectors, queries, args.k, args.factors),
+    )
+    if args.db:
+        _print_report(
+            f"\npgvector HNSW, recall@{args.k} against an exact scan",
+            bench_pgvector(args.queries, args.k, args.factors),
+        )
+
+
+if __name__ == "__main__":
+    main()
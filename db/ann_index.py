@@ -0,0 +1,545 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from db.vector_store import VectorStore
+
+# Inverted lists in the IVF index; 0 picks roughly sqrt(rows) when the index is trained
+LOCAL_INDEX_NLIST = int(os.getenv("LOCAL_INDEX_NLIST", "0"))
+# Lists scanned per query; higher is slower but closer to exact search
+LOCAL_INDEX_NPROBE = int(os.getenv("LOCAL_INDEX_NPROBE", "8"))
+# Below this many rows the index is scanned exhaustively instead of being trained
+LOCAL_INDEX_MIN_TRAIN = int(os.getenv("LOCAL_INDEX_MIN_TRAIN", "20000"))
+
+# Rows multiplied per block when assigning vectors to lists, to bound temporary memory
+_BLOCK_ROWS = 65536
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def _assign(vectors, centroids):
+    """
+    Assign each vector to its most similar centroid, a block of rows at a time.
+    """
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _BLOCK_ROWS):
+        block = np.asarray(vectors[start : start + _BLOCK_ROWS])
+        assignments[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def _train_centroids(vectors, nlist, iterations=10, sample_size=256 * 1024, seed=0):
+    """
+    Train spherical k-means centroids on a sample of the vectors.
+    """
+    rng = np.random.default_rng(seed)
+    sample_ids = np.sort(rng.choice(len(vectors), min(len(vectors), sample_size), replace=False))
+    sample = np.asarray(vectors[sample_ids])
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=nlist)
+        empty = counts == 0
+        # Reseed empty lists from random sample points so every list stays in use
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+def _top_k(scores, ids, k):
+    if len(scores) > k:
+        keep = np.argpartition(-scores, k - 1)[:k]
+        scores, ids = scores[keep], ids[keep]
+    order = np.argsort(-scores, kind="stable")
+    return scores[order], ids[order]
+
+
+def _write_json(path, value):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+def _write_text(path, value):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(value)
+    os.replace(tmp_path, path)
+
+
+class _Snapshot:
+    """
+    The immutable, memory-mapped part of the index as last persisted.
+    """
+
+    def __init__(self, index_dir):
+        if index_dir is not None and not os.path.exists(os.path.join(index_dir, "vectors.npy")):
+            index_dir = None
+        self.index_dir = index_dir
+        if index_dir is None:
+            self.vectors = np.empty((0, 0), dtype=np.float32)
+            self.title_ids = np.empty(0, dtype=np.int32)
+            self.lists = np.empty(0, dtype=np.int32)
+            self.centroids = None
+            self.list_order = self.list_bounds = None
+            self.metadata_offsets = np.zeros(1, dtype=np.int64)
+            self.trained_rows = 0
+            self._metadata = None
+            return
+        self.vectors = np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode="r")
+        self.title_ids = np.load(os.path.join(index_dir, "title_ids.npy"), mmap_mode="r")
+        self.lists = np.load(os.path.join(index_dir, "lists.npy"), mmap_mode="r")
+        self.metadata_offsets = np.load(os.path.join(index_dir, "metadata_offsets.npy"), mmap_mode="r")
+        centroids_path = os.path.join(index_dir, "centroids.npy")
+        self.centroids = np.load(centroids_path) if os.path.exists(centroids_path) else None
+        with open(os.path.join(index_dir, "info.json"), "r", encoding="utf-8") as f:
+            self.trained_rows = json.load(f)["trained_rows"]
+        if self.centroids is not None:
+            # Rows grouped by list, with list j occupying list_order[list_bounds[j]:list_bounds[j + 1]]
+            self.list_order = np.argsort(self.lists, kind="stable").astype(np.int64)
+            self.list_bounds = np.searchsorted(self.lists[self.list_order], np.arange(len(self.centroids) + 1))
+        else:
+            self.list_order = self.list_bounds = None
+        self._metadata = np.memmap(os.path.join(index_dir, "metadata.jsonl"), dtype=np.uint8, mode="r")
+
+    def __len__(self):
+        return len(self.title_ids)
+
+    def metadata_line(self, row):
+        start, end = self.metadata_offsets[row], self.metadata_offsets[row + 1]
+        return self._metadata[start:end].tobytes()
+
+    def metadata(self, row):
+        return json.loads(self.metadata_line(row))
+
+    def candidates(self, query, nprobe):
+        """
+        Return the ids of the rows to score for a query: the members of the nprobe closest lists, or every row.
+        """
+        if self.centroids is None:
+            return np.arange(len(self), dtype=np.int64)
+        probe = np.argsort(-(self.centroids @ query))[:nprobe]
+        return np.concatenate([self.list_order[self.list_bounds[j] : self.list_bounds[j + 1]] for j in probe])
+
+
+class LocalAnnStore(VectorStore):
+    """
+    In-process vector store that needs no database. Chunk vectors live in an IVF (inverted file) index of
+    normalized float32 NumPy arrays memory-mapped from disk, so several processes share the same pages.
+    Chunks added since the last snapshot are kept in memory and scanned exhaustively until snapshot() merges them.
+
+    Layout of the index directory:
+    books/               one UTF-8 text file per book, written as books are inserted
+    manifest.json        the ingestion manifest
+    generation           the corpus generation, bumped after every snapshot
+    current              the name of the snapshot directory in use, replaced atomically to publish a new snapshot
+    index.v<version>/    snapshots, never modified once published: vectors.npy, title_ids.npy, lists.npy, centroids.npy,
+                         book_centroids.npy, metadata.jsonl, metadata_offsets.npy, titles.json, info.json.
+                         The current and the previous one are kept, for readers that have not reloaded yet.
+    """
+
+    def __init__(self, path, nprobe=LOCAL_INDEX_NPROBE):
+        """
+        Parameters:
+        path (str): The directory holding the index. Created if missing.
+        nprobe (int): The number of inverted lists scanned per query.
+        """
+        self.path = path
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        os.makedirs(os.path.join(path, "books"), exist_ok=True)
+        manifest_path = os.path.join(path, "manifest.json")
+        self._manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                # Entries written before chunkers were configurable were all chunked by characters
+                self._manifest = {source: (*entry, "characters")[:6] for source, entry in json.load(f).items()}
+        self._load()
+
+    def _current_index_dir(self):
+        try:
+            with open(os.path.join(self.path, "current"), "r", encoding="utf-8") as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            # Written before snapshots were versioned
+            name = "index"
+        index_dir = os.path.join(self.path, name) if name else None
+        return index_dir if index_dir is not None and os.path.exists(index_dir) else None
+
+    def _read_snapshot(self):
+        # A snapshot taken concurrently by another process can remove the version just read from the pointer
+        for attempt in range(3):
+            index_dir = self._current_index_dir()
+            try:
+                snapshot = _Snapshot(index_dir)
+                if index_dir is not None and snapshot.index_dir is None:
+                    raise FileNotFoundError(index_dir)
+                titles = []
+                book_centroids = {}
+                if snapshot.index_dir is not None:
+                    with open(os.path.join(index_dir, "titles.json"), "r", encoding="utf-8") as f:
+                        titles = json.load(f)
+                    centroids = np.load(os.path.join(index_dir, "book_centroids.npy"))
+                    book_centroids = {i: centroids[i] for i in range(len(titles)) if centroids[i].any()}
+                return snapshot, titles, book_centroids
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+
+    def _load(self):
+        with self._lock:
+            self._snapshot, self._titles, self._book_centroids = self._read_snapshot()
+            self._generation = self._read_generation()
+            self._title_index = {title: i for i, title in enumerate(self._titles)}
+            self._pending_vectors = []
+            self._pending_rows = []
+            self._pending_matrix = None
+            self._deleted = set()
+
+    def _read_generation(self):
+        try:
+            with open(os.path.join(self.path, "generation"), "r") as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _book_path(self, title):
+        return os.path.join(self.path, "books", hashlib.sha256(title.encode("utf-8")).hexdigest() + ".txt")
+
+    def _title_id(self, title):
+        title_id = self._title_index.get(title)
+        if title_id is None:
+            title_id = len(self._titles)
+            self._titles.append(title)
+            self._title_index[title] = title_id
+        return title_id
+
+    def _pending(self):
+        if self._pending_matrix is None:
+            if self._pending_vectors:
+                self._pending_matrix = np.concatenate(self._pending_vectors)
+            else:
+                self._pending_matrix = np.empty((0, 0), dtype=np.float32)
+        return self._pending_matrix
+
+    def _row(self, row, snapshot=None, pending_rows=None):
+        """
+        Return (title_id, chunk_text, chunk_number, begin_offset) for a row of the snapshot or of the pending rows.
+        Rows scored outside the lock must be resolved against the snapshot and pending rows they were scored on,
+        since a reload in between replaces both.
+        """
+        snapshot = self._snapshot if snapshot is None else snapshot
+        pending_rows = self._pending_rows if pending_rows is None else pending_rows
+        persisted = len(snapshot)
+        if row < persisted:
+            chunk_text, chunk_number, begin_offset = snapshot.metadata(row)
+            return int(snapshot.title_ids[row]), chunk_text, chunk_number, begin_offset
+        return pending_rows[row - persisted]
+
+    def _rows_of(self, title_id):
+        persisted = len(self._snapshot)
+        rows = [int(row) for row in np.flatnonzero(np.asarray(self._snapshot.title_ids) == title_id)]
+        rows += [persisted + i for i, pending in enumerate(self._pending_rows) if pending[0] == title_id]
+        return [row for row in rows if row not in self._deleted]
+
+    def _vector(self, row):
+        persisted = len(self._snapshot)
+        if row < persisted:
+            return np.asarray(self._snapshot.vectors[row])
+        return self._pending()[row - persisted]
+
+    def insert_book(self, title, text):
+        book_path = self._book_path(title)
+        if os.path.exists(book_path):
+            return False
+        with open(book_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return True
+
+    def add_book_text_part(self, title, part_number, text):
+        # Parts are appended to a side file that replaces the book file once complete
+        with open(self._book_path(title) + ".parts", "w" if part_number == 1 else "a", encoding="utf-8") as f:
+            f.write(text)
+
+    def assemble_book_text(self, title):
+        parts_path = self._book_path(title) + ".parts"
+        if os.path.exists(parts_path):
+            os.replace(parts_path, self._book_path(title))
+        else:
+            open(self._book_path(title), "w").close()
+
+    def replace_book(self, title, text):
+        with self._lock:
+            title_id = self._title_index.get(title)
+            if title_id is not None:
+                self._deleted.update(self._rows_of(title_id))
+                self._book_centroids.pop(title_id, None)
+        with open(self._book_path(title), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def replace_document(self, title, text, chunks, chunk_numbers, begin_offsets, embeddings):
+        # Searches take the lock to read the index, so they see the book either before or after the replacement
+        with self._lock:
+            self.replace_book(title, text)
+            self.insert_chunks(title, chunks, chunk_numbers, begin_offsets, embeddings)
+            self.refresh_book(title)
+
+    def delete_book(self, title):
+        with self._lock:
+            title_id = self._title_index.get(title)
+            if title_id is not None:
+                self._deleted.update(self._rows_of(title_id))
+                self._book_centroids.pop(title_id, None)
+        for path in (self._book_path(title), self._book_path(title) + ".parts"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def insert_chunks(self, title, chunks, chunk_numbers, begin_offsets, embeddings):
+        vectors = _normalize(embeddings)
+        with self._lock:
+            title_id = self._title_id(title)
+            if len(vectors):
+                self._pending_vectors.append(vectors)
+                self._pending_matrix = None
+            for chunk, chunk_number, begin_offset in zip(chunks, chunk_numbers, begin_offsets):
+                self._pending_rows.append((title_id, chunk, int(chunk_number), int(begin_offset)))
+
+    def refresh_book(self, title):
+        with self._lock:
+            title_id = self._title_index.get(title)
+            if title_id is None:
+                return
+            rows = self._rows_of(title_id)
+            if rows:
+                self._book_centroids[title_id] = np.mean([self._vector(row) for row in rows], axis=0)
+            else:
+                self._book_centroids.pop(title_id, None)
+
+    def book_chunk_embeddings(self, title):
+        with self._lock:
+            title_id = self._title_index.get(title)
+            if title_id is None:
+                return []
+            return [(self._row(row)[1], self._vector(row)) for row in self._rows_of(title_id)]
+
+    def get_book_text(self, title):
+        with open(self._book_path(title), "r", encoding="utf-8") as f:
+            return f.read()
+
+    def query_chunks(self, embedding, top_n=5, ef_search=None, probes=None):
+        # There is no graph here; probes overrides the number of inverted lists scanned
+        query = _normalize(embedding)
+        with self._lock:
+            snapshot, pending, deleted = self._snapshot, self._pending(), set(self._deleted)
+            # Both lists are only appended to until a reload replaces them, so the references stay consistent
+            pending_rows, titles = self._pending_rows, self._titles
+        ids = snapshot.candidates(query, probes or self.nprobe)
+        scores = np.asarray(snapshot.vectors[ids]) @ query if len(ids) else np.empty(0, dtype=np.float32)
+        if len(pending):
+            ids = np.concatenate([ids, np.arange(len(snapshot), len(snapshot) + len(pending))])
+            scores = np.concatenate([scores, pending @ query])
+        if deleted:
+            alive = ~np.isin(ids, list(deleted))
+            ids, scores = ids[alive], scores[alive]
+        scores, ids = _top_k(scores, ids, top_n)
+        results = []
+        for score, row in zip(scores, ids):
+            title_id, chunk_text, _, begin_offset = self._row(int(row), snapshot, pending_rows)
+            results.append((titles[title_id], chunk_text, float(1 - score), begin_offset))
+        return results
+
+    def query_books(self, embedding, top_n=5, ef_search=None):
+        query = _normalize(embedding)
+        with self._lock:
+            if not self._book_centroids:
+                return []
+            title_ids = np.fromiter(self._book_centroids.keys(), dtype=np.int64)
+            centroids = np.stack(list(self._book_centroids.values()))
+            titles = self._titles
+        scores, title_ids = _top_k(_normalize(centroids) @ query, title_ids, top_n)
+        return [
+            (titles[title_id], self._book_centroids.get(int(title_id)), float(1 - score))
+            for score, title_id in zip(scores, title_ids)
+        ]
+
+    def iter_chunk_embeddings(self, batch_size=10000):
+        with self._lock:
+            snapshot, pending, deleted = self._snapshot, self._pending(), set(self._deleted)
+            pending_rows, titles, generation = list(self._pending_rows), list(self._titles), self._generation
+        rows = [row for row in range(len(snapshot) + len(pending_rows)) if row not in deleted]
+        yield len(rows), generation
+        for start in range(0, len(rows), batch_size):
+            batch = []
+            for row in rows[start : start + batch_size]:
+                if row < len(snapshot):
+                    chunk_text, _, begin_offset = snapshot.metadata(row)
+                    title_id, vector = int(snapshot.title_ids[row]), np.asarray(snapshot.vectors[row])
+                else:
+                    title_id, chunk_text, _, begin_offset = pending_rows[row - len(snapshot)]
+                    vector = pending[row - len(snapshot)]
+                batch.append((titles[title_id], chunk_text, begin_offset, vector))
+            yield batch
+
+    def get_corpus_generation(self):
+        generation = self._read_generation()
+        with self._lock:
+            if generation != self._generation and not self._pending_rows and not self._deleted:
+                # Another process took a snapshot, so pick up its files
+                self._load()
+            return self._generation
+
+    def bump_corpus_generation(self):
+        with self._lock:
+            self.snapshot()
+            self._generation = self._read_generation() + 1
+            tmp_path = os.path.join(self.path, f"generation.tmp-{os.getpid()}")
+            with open(tmp_path, "w") as f:
+                f.write(str(self._generation))
+            os.replace(tmp_path, os.path.join(self.path, "generation"))
+            return self._generation
+
+    def manifest_entries(self):
+        with self._lock:
+            return dict(self._manifest)
+
+    def upsert_manifest_entry(self, source_path, book_title, content_hash, model_name, chunk_length, chunk_overlap, chunker):
+        with self._lock:
+            self._manifest[source_path] = (book_title, content_hash, model_name, chunk_length, chunk_overlap, chunker)
+            _write_json(os.path.join(self.path, "manifest.json"), self._manifest)
+
+    def delete_manifest_entry(self, source_path):
+        with self._lock:
+            self._manifest.pop(source_path, None)
+            _write_json(os.path.join(self.path, "manifest.json"), self._manifest)
+
+    def clear(self):
+        with self._lock:
+            _write_text(os.path.join(self.path, "current"), "")
+            self._remove_snapshots()
+            shutil.rmtree(os.path.join(self.path, "books"), ignore_errors=True)
+            os.makedirs(os.path.join(self.path, "books"), exist_ok=True)
+            self._manifest = {}
+            _write_json(os.path.join(self.path, "manifest.json"), self._manifest)
+            generation = self._generation
+            self._load()
+            self._generation = generation
+
+    def drop(self):
+        self.clear()
+
+    def _remove_snapshots(self, keep=()):
+        # Only published versions; directories other processes are still writing are named index.new-<pid>
+        for name in os.listdir(self.path):
+            if (name == "index" or name.startswith("index.v")) and name not in keep:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    def snapshot(self):
+        """
+        Merge the pending rows into a new on-disk snapshot, dropping deleted rows, and memory-map it.
+        The inverted lists are trained once the index holds LOCAL_INDEX_MIN_TRAIN rows and retrained whenever it has
+        doubled in size since; otherwise only the new rows are assigned to the existing lists.
+
+        Parameters:
+        None
+
+        Returns:
+        None
+        """
+        with self._lock:
+            old = self._snapshot
+            pending = self._pending()
+            if not self._deleted and not self._pending_rows:
+                return
+            alive = np.ones(len(old) + len(self._pending_rows), dtype=bool)
+            alive[list(self._deleted)] = False
+            keep = np.flatnonzero(alive)
+            generation = self._generation
+            previous = os.path.basename(old.index_dir) if old.index_dir is not None else None
+            if not len(keep):
+                # Nothing left, and NumPy cannot memory-map empty files
+                _write_text(os.path.join(self.path, "current"), "")
+                self._remove_snapshots(keep=(previous,))
+                self._load()
+                self._generation = generation
+                return
+            dimensions = old.vectors.shape[1] if len(old) else pending.shape[1] if len(pending) else 0
+            new_dir = os.path.join(self.path, f"index.new-{os.getpid()}")
+            shutil.rmtree(new_dir, ignore_errors=True)
+            os.makedirs(new_dir)
+
+            kept_old = keep[keep < len(old)]
+            kept_pending = keep[keep >= len(old)] - len(old)
+            vectors = np.lib.format.open_memmap(
+                os.path.join(new_dir, "vectors.npy"), mode="w+", dtype=np.float32, shape=(len(keep), dimensions)
+            )
+            for start in range(0, len(kept_old), _BLOCK_ROWS):
+                block = kept_old[start : start + _BLOCK_ROWS]
+                vectors[start : start + len(block)] = old.vectors[block]
+            if len(kept_pending):
+                vectors[len(kept_old) :] = pending[kept_pending]
+
+            title_ids = np.empty(len(keep), dtype=np.int32)
+            offsets = np.zeros(len(keep) + 1, dtype=np.int64)
+            title_ids[: len(kept_old)] = np.asarray(old.title_ids)[kept_old]
+            with open(os.path.join(new_dir, "metadata.jsonl"), "wb") as f:
+                # Lines of surviving snapshot rows are copied as raw bytes; only pending rows are serialized
+                for i, row in enumerate(kept_old):
+                    line = old.metadata_line(int(row))
+                    f.write(line)
+                    offsets[i + 1] = offsets[i] + len(line)
+                for i, row in enumerate(kept_pending, start=len(kept_old)):
+                    title_id, chunk_text, chunk_number, begin_offset = self._pending_rows[int(row)]
+                    title_ids[i] = title_id
+                    line = (json.dumps([chunk_text, chunk_number, begin_offset]) + "\n").encode("utf-8")
+                    f.write(line)
+                    offsets[i + 1] = offsets[i] + len(line)
+
+            centroids = old.centroids
+            trained_rows = old.trained_rows
+            retrain = len(keep) >= LOCAL_INDEX_MIN_TRAIN and (centroids is None or len(keep) >= 2 * trained_rows)
+            if retrain:
+                nlist = LOCAL_INDEX_NLIST or max(1, int(np.sqrt(len(keep))))
+                centroids = _train_centroids(vectors, min(nlist, len(keep)))
+                trained_rows = len(keep)
+                lists = _assign(vectors, centroids)
+            elif centroids is not None:
+                lists = np.concatenate([np.asarray(old.lists)[kept_old], _assign(vectors[len(kept_old) :], centroids)])
+            else:
+                lists = np.zeros(len(keep), dtype=np.int32)
+
+            book_centroids = np.zeros((len(self._titles), dimensions), dtype=np.float32)
+            for title_id, centroid in self._book_centroids.items():
+                book_centroids[title_id] = centroid
+
+            vectors.flush()
+            del vectors
+            np.save(os.path.join(new_dir, "title_ids.npy"), title_ids)
+            np.save(os.path.join(new_dir, "lists.npy"), lists.astype(np.int32))
+            np.save(os.path.join(new_dir, "metadata_offsets.npy"), offsets)
+            np.save(os.path.join(new_dir, "book_centroids.npy"), book_centroids)
+            if centroids is not None:
+                np.save(os.path.join(new_dir, "centroids.npy"), centroids)
+            _write_json(os.path.join(new_dir, "titles.json"), self._titles)
+            _write_json(os.path.join(new_dir, "info.json"), {"trained_rows": trained_rows})
+
+            # Publish the new version by replacing the pointer file, which is atomic, so a reader finds either the old
+            # or the new snapshot and never none. The previous version stays for processes that have not reloaded yet.
+            version = f"index.v{time.time_ns()}-{os.getpid()}"
+            os.rename(new_dir, os.path.join(self.path, version))
+            _write_text(os.path.join(self.path, "current"), version)
+            self._remove_snapshots(keep=(version, previous))
+
+            self._load()
+            self._generation = generation
@@ -0,0 +1,98 @@
+import io
+import struct
+
+import numpy as np
+
+from db.pool import get_connection
+
+# PostgreSQL binary COPY header: signature, flags and header extension length
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+COPY_TRAILER = struct.pack(">h", -1)
+
+BINARY_COPY_CHUNKS = """
+                    COPY book_embeddings (book_title, chunk_text, chunk_number, begin_offset, embedding)
+                    FROM STDIN WITH (FORMAT binary);
+                    """
+
+# Field count, then length-prefixed book_title
+_ROW_START = struct.Struct(">hi")
+# Length-prefixed chunk_text
+_TEXT_LENGTH = struct.Struct(">i")
+# Length-prefixed chunk_number and begin_offset, then the length prefix and header of the vector
+_ROW_MIDDLE = struct.Struct(">iiiiiHH")
+
+
+def encode_chunk_rows(title, chunks, chunk_numbers, begin_offsets, embeddings):
+    """
+    Serialize book_embeddings rows in PostgreSQL binary COPY format.
+    Vectors use pgvector's binary representation (uint16 dimensions, uint16 unused, big-endian float4 values)
+    and are written straight from the embedding matrix without a round trip through text.
+
+    Parameters:
+    title (str): The title of the book every row belongs to.
+    chunks (List[str]): The text of each chunk.
+    chunk_numbers (Iterable[int]): The chunk number of each chunk.
+    begin_offsets (Iterable[int]): The offset of each chunk in the book text.
+    embeddings (np.array): A (rows, dimensions) matrix of chunk embeddings.
+
+    Returns:
+    bytes: The COPY payload, including header and trailer.
+    """
+    matrix = np.ascontiguousarray(embeddings, dtype=">f4")
+    rows, dimensions = matrix.shape if matrix.ndim == 2 else (0, 0)
+    vector_bytes = matrix.tobytes()
+    vector_size = dimensions * 4
+    title_bytes = title.encode("utf-8")
+    row_start = _ROW_START.pack(5, len(title_bytes)) + title_bytes
+
+    parts = [COPY_HEADER]
+    for i, (chunk, chunk_number, begin_offset) in enumerate(zip(chunks, chunk_numbers, begin_offsets)):
+        chunk_bytes = chunk.encode("utf-8")
+        parts.append(row_start)
+        parts.append(_TEXT_LENGTH.pack(len(chunk_bytes)))
+        parts.append(chunk_bytes)
+        parts.append(_ROW_MIDDLE.pack(4, int(chunk_number), 4, int(begin_offset), 4 + vector_size, dimensions, 0))
+        parts.append(vector_bytes[i * vector_size : (i + 1) * vector_size])
+    if len(parts) - 1 != rows * 5:
+        raise ValueError(f"Got {(len(parts) - 1) // 5} chunks but {rows} embeddings")
+    parts.append(COPY_TRAILER)
+    return b"".join(parts)
+
+
+def binary_pg_insert(title, chunks, chunk_numbers, begin_offsets, embeddings):
+    """
+    Insert the chunks of a book into book_embeddings using binary COPY.
+
+    Parameters:
+    title (str): The title of the book every row belongs to.
+    chunks (List[str]): The text of each chunk.
+    chunk_numbers (Iterable[int]): The chunk number of each chunk.
+    begin_offsets (Iterable[int]): The offset of each chunk in the book text.
+    embeddings (np.array): A (rows, dimensions) matrix of chunk embeddings.
+
+    Returns:
+    None
+    """
+    with get_connection() as connection:
+        with connection.cursor() as cursor:
+            copy_chunk_rows(cursor, title, chunks, chunk_numbers, begin_offsets, embeddings)
+        connection.commit()
+
+
+def copy_chunk_rows(cursor, title, chunks, chunk_numbers, begin_offsets, embeddings):
+    """
+    COPY the chunks of a book into book_embeddings within the cursor's transaction, without committing.
+
+    Parameters:
+    cursor (psycopg2.extensions.cursor): The cursor of the transaction to insert in.
+    title (str): The title of the book every row belongs to.
+    chunks (List[str]): The text of each chunk.
+    chunk_numbers (Iterable[int]): The chunk number of each chunk.
+    begin_offsets (Iterable[int]): The offset of each chunk in the book text.
+    embeddings (np.array): A (rows, dimensions) matrix of chunk embeddings.
+
+    Returns:
+    None
+    """
+    payload = io.BytesIO(encode_chunk_rows(title, chunks, chunk_numbers, begin_offsets, embeddings))
+    cursor.copy_expert(BINARY_COPY_CHUNKS, payload)
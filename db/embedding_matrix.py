@@ -0,0 +1,259 @@
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from db.quantization import QUANTIZATION_MODES
+from db.quantization import RESCORE_FACTOR
+from db.quantization import compact_scores
+from db.quantization import int8_scale
+from db.quantization import quantize
+from db.quantization import rescore
+from db.quantization import top_k
+
+# Directory of the exported matrix; exact search over it is used once it exists and matches the corpus
+EMBEDDING_MATRIX_PATH = os.getenv("EMBEDDING_MATRIX_PATH", "embedding_matrix")
+EMBEDDING_MATRIX = os.getenv("EMBEDDING_MATRIX", "false").lower() in ("1", "true", "yes")
+# "float16", "int8" or "binary" also exports a compact copy that is scanned first, with candidates rescored in float32
+EMBEDDING_MATRIX_QUANTIZATION = os.getenv("EMBEDDING_MATRIX_QUANTIZATION") or None
+
+# Rows quantized at a time during export
+_BLOCK_ROWS = 65536
+# Queries scored together by query_batch, bounding the (rows, queries) score matrix
+_QUERY_BLOCK = 64
+
+_matrix = None
+_matrix_stamp = None
+_matrix_lock = threading.Lock()
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def _write_compact(directory, embeddings, mode):
+    """
+    Write the quantized copy of an exported matrix, a block of rows at a time.
+    """
+    scale = None
+    if mode == "int8":
+        scale = int8_scale(embeddings)
+        np.save(os.path.join(directory, "int8_scale.npy"), scale)
+    first = quantize(embeddings[:1], mode, scale)
+    compact = np.lib.format.open_memmap(
+        os.path.join(directory, f"embeddings_{mode}.npy"),
+        mode="w+",
+        dtype=first.dtype,
+        shape=(len(embeddings), *first.shape[1:]),
+    )
+    for start in range(0, len(embeddings), _BLOCK_ROWS):
+        block = embeddings[start : start + _BLOCK_ROWS]
+        compact[start : start + len(block)] = quantize(block, mode, scale)
+    compact.flush()
+
+
+def export_embedding_matrix(rows, path=EMBEDDING_MATRIX_PATH, quantization=EMBEDDING_MATRIX_QUANTIZATION):
+    """
+    Write chunk embeddings to a directory of NumPy files that EmbeddingMatrix memory-maps.
+    The export is built next to the target and swapped in atomically, so running searches keep reading the old one.
+
+    Layout of the directory:
+    embeddings.npy       (chunks, dimensions) normalized float32 matrix
+    title_ids.npy        index into titles.json of each chunk's book
+    begin_offsets.npy    offset of each chunk in its book's text
+    chunk_text.bin       UTF-8 chunk texts back to back, chunk i spanning text_offsets[i]:text_offsets[i + 1]
+    text_offsets.npy     byte offsets into chunk_text.bin
+    titles.json          book titles
+    info.json            number of chunks, quantization and the corpus generation the export was taken at
+    embeddings_<mode>.npy  the quantized copy, plus int8_scale.npy for int8
+
+    Parameters:
+    rows (Iterator): The output of VectorStore.iter_chunk_embeddings: the chunk count and corpus generation,
+    then batches of (book_title, chunk_text, begin_offset, embedding) rows.
+    path (str): The directory to write.
+    quantization (str): One of QUANTIZATION_MODES to also write a compact copy, or None.
+
+    Returns:
+    Tuple[int, int]: The number of chunks exported and the corpus generation.
+    """
+    if quantization is not None and quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode: {quantization}")
+    count, generation = next(rows)
+    new_dir = f"{path}.new-{os.getpid()}"
+    shutil.rmtree(new_dir, ignore_errors=True)
+    os.makedirs(new_dir)
+
+    embeddings = None
+    title_ids = np.empty(count, dtype=np.int32)
+    begin_offsets = np.empty(count, dtype=np.int64)
+    text_offsets = np.zeros(count + 1, dtype=np.int64)
+    titles = {}
+    written = 0
+    with open(os.path.join(new_dir, "chunk_text.bin"), "wb") as text_file:
+        for batch in rows:
+            if written + len(batch) > count:
+                raise RuntimeError("The corpus changed during the export")
+            vectors = _normalize([embedding for *_, embedding in batch])
+            if embeddings is None:
+                # NumPy cannot memory-map an empty file, so an empty corpus is never opened this way
+                embeddings = np.lib.format.open_memmap(
+                    os.path.join(new_dir, "embeddings.npy"), mode="w+", dtype=np.float32, shape=(count, vectors.shape[1])
+                )
+            embeddings[written : written + len(batch)] = vectors
+            for i, (title, chunk_text, begin_offset, _) in enumerate(batch, start=written):
+                title_ids[i] = titles.setdefault(title, len(titles))
+                begin_offsets[i] = begin_offset
+                chunk_bytes = chunk_text.encode("utf-8")
+                text_file.write(chunk_bytes)
+                text_offsets[i + 1] = text_offsets[i] + len(chunk_bytes)
+            written += len(batch)
+    if written != count:
+        raise RuntimeError("The corpus changed during the export")
+    if embeddings is None:
+        np.save(os.path.join(new_dir, "embeddings.npy"), np.empty((0, 0), dtype=np.float32))
+        quantization = None
+    else:
+        embeddings.flush()
+        if quantization is not None:
+            _write_compact(new_dir, embeddings, quantization)
+        del embeddings
+
+    np.save(os.path.join(new_dir, "title_ids.npy"), title_ids)
+    np.save(os.path.join(new_dir, "begin_offsets.npy"), begin_offsets)
+    np.save(os.path.join(new_dir, "text_offsets.npy"), text_offsets)
+    with open(os.path.join(new_dir, "titles.json"), "w", encoding="utf-8") as f:
+        json.dump(list(titles), f)
+    with open(os.path.join(new_dir, "info.json"), "w", encoding="utf-8") as f:
+        json.dump({"chunks": count, "generation": generation, "quantization": quantization}, f)
+
+    old_dir = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        os.rename(path, old_dir)
+    os.rename(new_dir, path)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return count, generation
+
+
+class EmbeddingMatrix:
+    """
+    Exact chunk search over an exported embedding matrix. Every array is memory-mapped read-only,
+    so all worker processes on a host share the same page-cache pages instead of each loading a copy.
+    """
+
+    def __init__(self, path=EMBEDDING_MATRIX_PATH):
+        """
+        Parameters:
+        path (str): The directory written by export_embedding_matrix.
+        """
+        self.path = path
+        with open(os.path.join(path, "info.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+        self.generation = info["generation"]
+        self.quantization = info.get("quantization")
+        self.compact = self.scale = None
+        with open(os.path.join(path, "titles.json"), "r", encoding="utf-8") as f:
+            self.titles = json.load(f)
+        self.title_ids = np.load(os.path.join(path, "title_ids.npy"), mmap_mode="r")
+        self.begin_offsets = np.load(os.path.join(path, "begin_offsets.npy"), mmap_mode="r")
+        self.text_offsets = np.load(os.path.join(path, "text_offsets.npy"), mmap_mode="r")
+        if info["chunks"]:
+            self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+            self._text = np.memmap(os.path.join(path, "chunk_text.bin"), dtype=np.uint8, mode="r")
+            if self.quantization is not None:
+                self.compact = np.load(os.path.join(path, f"embeddings_{self.quantization}.npy"), mmap_mode="r")
+            if self.quantization == "int8":
+                self.scale = np.load(os.path.join(path, "int8_scale.npy"))
+        else:
+            self.embeddings = np.empty((0, 0), dtype=np.float32)
+            self._text = None
+
+    def __len__(self):
+        return len(self.title_ids)
+
+    def chunk_text(self, row):
+        start, end = self.text_offsets[row], self.text_offsets[row + 1]
+        return self._text[start:end].tobytes().decode("utf-8")
+
+    def query(self, embedding, top_n=5):
+        """
+        Find the chunks closest to an embedding by cosine distance with one matrix-vector product.
+        With a quantized copy, the compact matrix is scanned instead and only the best top_n * RESCORE_FACTOR
+        candidates are rescored against the float32 rows.
+
+        Parameters:
+        embedding (List[float]): The query embedding.
+        top_n (int): The number of results to return.
+
+        Returns:
+        List[Tuple[str, str, float, int]]: The (book_title, chunk_text, distance, begin_offset) of each result,
+        closest first, like the pgvector chunk query.
+        """
+        if not len(self):
+            return []
+        query = _normalize(embedding)
+        if self.compact is None:
+            scores = self.embeddings @ query
+            top = top_k(scores, top_n)
+            scores = scores[top]
+        else:
+            candidates = top_k(compact_scores(self.compact, query, self.quantization, self.scale), top_n * RESCORE_FACTOR)
+            top, scores = rescore(self.embeddings, query, candidates, top_n)
+        return self._results(top, scores)
+
+    def _results(self, rows, scores):
+        return [
+            (self.titles[self.title_ids[row]], self.chunk_text(row), float(1 - score), int(self.begin_offsets[row]))
+            for row, score in zip(rows, scores)
+        ]
+
+    def query_batch(self, embeddings, top_n=5):
+        """
+        Find the chunks closest to each of several embeddings, scoring a block of queries per pass over the matrix.
+
+        Parameters:
+        embeddings (List[List[float]]): The query embeddings.
+        top_n (int): The number of results to return per query.
+
+        Returns:
+        List[List[Tuple[str, str, float, int]]]: The results of each query, as returned by query.
+        """
+        if self.compact is not None or not len(self):
+            return [self.query(embedding, top_n) for embedding in embeddings]
+        queries = _normalize(embeddings)
+        results = []
+        for start in range(0, len(queries), _QUERY_BLOCK):
+            block_scores = self.embeddings @ queries[start : start + _QUERY_BLOCK].T
+            for scores in block_scores.T:
+                top = top_k(scores, top_n)
+                results.append(self._results(top, scores[top]))
+        return results
+
+
+def get_embedding_matrix():
+    """
+    Get the exported embedding matrix if exact search over it is enabled, reopening it after a new export.
+
+    Parameters:
+    None
+
+    Returns:
+    EmbeddingMatrix: The memory-mapped matrix, or None if EMBEDDING_MATRIX is off or nothing has been exported.
+    """
+    global _matrix, _matrix_stamp
+    if not EMBEDDING_MATRIX:
+        return None
+    try:
+        info = os.stat(os.path.join(EMBEDDING_MATRIX_PATH, "info.json"))
+    except FileNotFoundError:
+        return None
+    # A new export replaces the directory, so info.json is a new file
+    stamp = (info.st_ino, info.st_mtime_ns)
+    with _matrix_lock:
+        if stamp != _matrix_stamp:
+            _matrix = EmbeddingMatrix(EMBEDDING_MATRIX_PATH)
+            _matrix_stamp = stamp
+        return _matrix
@@ -0,0 +1,215 @@
+import os
+import threading
+import time
+
+import psycopg2.errors
+
+from db.db_methods import CREATE_CENTROID_INDEX
+from db.db_methods import HNSW_EF_CONSTRUCTION
+from db.db_methods import HNSW_M
+from db.db_methods import INDEX_TYPE
+from db.db_methods import IVFFLAT_LISTS
+from db.db_methods import forget_index_options
+from db.db_methods import index_statement
+from db.pool import get_autocommit_connection
+from db.pool import get_connection
+
+# Session settings of index builds; parallel workers need pgvector 0.6+ for HNSW
+INDEX_MAINTENANCE_WORK_MEM = os.getenv("INDEX_MAINTENANCE_WORK_MEM", "1GB")
+INDEX_PARALLEL_WORKERS = int(os.getenv("INDEX_PARALLEL_WORKERS", "4"))
+# Seconds between progress reports while an index builds
+INDEX_PROGRESS_INTERVAL = float(os.getenv("INDEX_PROGRESS_INTERVAL", "2"))
+# How long renaming the rebuilt index may wait for its lock before giving up and retrying, so it never queues
+# searches behind a long transaction; and how many times it is tried
+INDEX_SWAP_LOCK_TIMEOUT = os.getenv("INDEX_SWAP_LOCK_TIMEOUT", "2s")
+INDEX_SWAP_ATTEMPTS = int(os.getenv("INDEX_SWAP_ATTEMPTS", "10"))
+
+GET_INDEX_DEFINITION = "SELECT indexdef FROM pg_indexes WHERE indexname = %s;"
+
+DROP_INDEX_CONCURRENTLY = "DROP INDEX CONCURRENTLY IF EXISTS {name};"
+
+SET_LOCK_TIMEOUT = "SET LOCAL lock_timeout = %s;"
+
+RENAME_NEW_INDEX = "ALTER INDEX embedding_idx_new RENAME TO embedding_idx;"
+
+GET_INDEX_PROGRESS = """
+                SELECT phase, blocks_done, blocks_total, tuples_done, tuples_total
+                FROM pg_stat_progress_create_index
+                WHERE pid = %s;
+                """
+
+
+def print_progress(phase, done, total):
+    """
+    Print one line of index build progress.
+
+    Parameters:
+    phase (str): The build phase reported by PostgreSQL.
+    done (int): The blocks or tuples processed in this phase.
+    total (int): The blocks or tuples to process in this phase, 0 if unknown.
+
+    Returns:
+    None
+    """
+    print(f"  {phase}: {done / total:.0%}" if total else f"  {phase}", flush=True)
+
+
+def get_index_definition(name="embedding_idx"):
+    """
+    Retrieve the CREATE INDEX statement of an existing index.
+
+    Parameters:
+    name (str): The name of the index.
+
+    Returns:
+    str: The index definition, or None if the index does not exist.
+    """
+    with get_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(GET_INDEX_DEFINITION, (name,))
+            row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def drop_index_concurrently(name="embedding_idx"):
+    """
+    Drop an index without blocking searches or writes on book_embeddings.
+
+    Parameters:
+    name (str): The name of the index.
+
+    Returns:
+    None
+    """
+    with get_autocommit_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(DROP_INDEX_CONCURRENTLY.format(name=name))
+
+
+def _concurrently(statement):
+    return statement.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)
+
+
+def build_index_concurrently(statement, name, report=print_progress):
+    """
+    Run a CREATE INDEX statement CONCURRENTLY with INDEX_MAINTENANCE_WORK_MEM and INDEX_PARALLEL_WORKERS,
+    reporting progress from pg_stat_progress_create_index every INDEX_PROGRESS_INTERVAL seconds.
+    Searches and inserts keep running while the index builds. If the build fails, the invalid index it leaves is dropped.
+
+    Parameters:
+    statement (str): The CREATE INDEX statement.
+    name (str): The name of the index the statement creates.
+    report (Callable[[str, int, int], None]): Called with the phase, work done and total work on every change.
+
+    Returns:
+    None
+    """
+    state = {}
+    started = threading.Event()
+
+    def build():
+        try:
+            with get_autocommit_connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute("SET maintenance_work_mem = %s;", (INDEX_MAINTENANCE_WORK_MEM,))
+                    cursor.execute("SET max_parallel_maintenance_workers = %s;", (INDEX_PARALLEL_WORKERS,))
+                    cursor.execute("SELECT pg_backend_pid();")
+                    state["pid"] = cursor.fetchone()[0]
+                    started.set()
+                    cursor.execute(_concurrently(statement))
+        except Exception as e:
+            state["error"] = e
+        finally:
+            started.set()
+
+    builder = threading.Thread(target=build, daemon=True)
+    builder.start()
+    started.wait()
+    last = None
+    while builder.is_alive():
+        builder.join(INDEX_PROGRESS_INTERVAL)
+        if not builder.is_alive() or "pid" not in state:
+            continue
+        with get_connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(GET_INDEX_PROGRESS, (state["pid"],))
+                row = cursor.fetchone()
+        if row is not None and row != last:
+            phase, blocks_done, blocks_total, tuples_done, tuples_total = row
+            if tuples_total:
+                report(phase, tuples_done, tuples_total)
+            else:
+                report(phase, blocks_done, blocks_total)
+            last = row
+
+    if "error" in state:
+        drop_index_concurrently(name)
+        raise state["error"]
+
+
+def rebuild_index(
+    index_type=INDEX_TYPE, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, lists=IVFFLAT_LISTS, report=print_progress
+):
+    """
+    Rebuild the chunk index without taking search offline. The new index is built CONCURRENTLY next to the
+    current one, which keeps serving searches. The old index is then dropped CONCURRENTLY and the new one renamed
+    in its place, under a lock_timeout.
+
+    Parameters:
+    index_type (str): "hnsw" or "ivfflat".
+    m (int): The maximum number of connections per HNSW layer.
+    ef_construction (int): The candidate list size while building an HNSW index.
+    lists (int): The number of IVFFlat lists, or 0 to choose it from the number of rows.
+    report (Callable[[str, int, int], None]): Called with build progress.
+
+    Returns:
+    Dict: The type and build parameters of the new index.
+    """
+    # Left behind if an earlier rebuild was interrupted
+    drop_index_concurrently("embedding_idx_new")
+    with get_connection() as connection:
+        with connection.cursor() as cursor:
+            statement, parameters = index_statement(cursor, index_type, m, ef_construction, lists, "embedding_idx_new")
+    build_index_concurrently(statement, "embedding_idx_new", report)
+    # A plain DROP INDEX would take an ACCESS EXCLUSIVE lock on book_embeddings, queue behind running searches and
+    # block new ones. Dropped CONCURRENTLY, the old index keeps serving until no query uses it, and the new one serves
+    # searches in the meantime.
+    drop_index_concurrently("embedding_idx")
+    _rename_new_index()
+    forget_index_options()
+    return parameters
+
+
+def _rename_new_index():
+    """
+    Rename embedding_idx_new to embedding_idx. Renaming an index only locks the index itself, against other schema
+    changes; lock_timeout keeps it from waiting on one for long, and it is retried instead.
+    """
+    for attempt in range(INDEX_SWAP_ATTEMPTS):
+        try:
+            with get_connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(SET_LOCK_TIMEOUT, (INDEX_SWAP_LOCK_TIMEOUT,))
+                    cursor.execute(RENAME_NEW_INDEX)
+                    cursor.execute(CREATE_CENTROID_INDEX)
+                    connection.commit()
+            return
+        except psycopg2.errors.LockNotAvailable:
+            if attempt == INDEX_SWAP_ATTEMPTS - 1:
+                raise
+            time.sleep(min(2**attempt, 30) * 0.1)
+
+
+def restore_index(definition, report=print_progress):
+    """
+    Recreate the chunk index CONCURRENTLY from the definition saved before a bulk load dropped it.
+
+    Parameters:
+    definition (str): The index definition returned by get_index_definition.
+    report (Callable[[str, int, int], None]): Called with build progress.
+
+    Returns:
+    None
+    """
+    build_index_concurrently(definition, "embedding_idx", report)
+    forget_index_options()
@@ -0,0 +1,111 @@
+import os
+
+import numpy as np
+
+# Candidates retrieved from a quantized representation per requested result, before rescoring at full precision
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR", "4"))
+
+# Compact representations of normalized float32 embeddings, smallest last
+QUANTIZATION_MODES = ("float16", "int8", "binary")
+
+# Rows converted to float32 at a time while scoring, to bound temporary memory
+_BLOCK_ROWS = 65536
+# Number of set bits in every byte value, for Hamming distances between packed sign bits
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+
+def int8_scale(vectors):
+    """
+    Compute the per-dimension scale of scalar int8 quantization from the largest magnitude in each dimension.
+
+    Parameters:
+    vectors (np.array): A (rows, dimensions) float32 matrix.
+
+    Returns:
+    np.array: One float32 scale per dimension, mapping [-127, 127] back to the original range.
+    """
+    peak = np.zeros(vectors.shape[1], dtype=np.float32)
+    for start in range(0, len(vectors), _BLOCK_ROWS):
+        peak = np.maximum(peak, np.abs(np.asarray(vectors[start : start + _BLOCK_ROWS])).max(axis=0))
+    return np.maximum(peak, 1e-12) / 127
+
+
+def quantize(vectors, mode, scale=None):
+    """
+    Quantize embeddings to a compact representation.
+
+    Parameters:
+    vectors (np.array): A (rows, dimensions) float32 matrix.
+    mode (str): "float16", "int8" (scaled per dimension by scale) or "binary" (sign bits packed 8 per byte).
+    scale (np.array): The int8_scale of the corpus; only used by "int8".
+
+    Returns:
+    np.array: The quantized matrix.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if mode == "float16":
+        return vectors.astype(np.float16)
+    if mode == "int8":
+        return np.clip(np.rint(vectors / scale), -127, 127).astype(np.int8)
+    if mode == "binary":
+        return np.packbits(vectors > 0, axis=-1)
+    raise ValueError(f"Unknown quantization mode: {mode}")
+
+
+def compact_scores(compact, query, mode, scale=None):
+    """
+    Score every quantized row against a float32 query; higher is closer.
+    float16 and int8 rows are scored by dot product against the full-precision query, binary rows by negated
+    Hamming distance between sign bits.
+
+    Parameters:
+    compact (np.array): The output of quantize, possibly memory-mapped.
+    query (np.array): The normalized float32 query.
+    mode (str): The quantization mode of compact.
+    scale (np.array): The int8_scale of the corpus; only used by "int8".
+
+    Returns:
+    np.array: One float32 score per row.
+    """
+    scores = np.empty(len(compact), dtype=np.float32)
+    if mode == "binary":
+        query_bits = quantize(query, "binary")
+        for start in range(0, len(compact), _BLOCK_ROWS):
+            block = np.asarray(compact[start : start + _BLOCK_ROWS])
+            scores[start : start + len(block)] = -_POPCOUNT[block ^ query_bits].sum(axis=1)
+        return scores
+    if mode == "int8":
+        # Fold the scale into the query instead of dequantizing every row
+        query = query * scale
+    for start in range(0, len(compact), _BLOCK_ROWS):
+        block = np.asarray(compact[start : start + _BLOCK_ROWS], dtype=np.float32)
+        scores[start : start + len(block)] = block @ query
+    return scores
+
+
+def top_k(scores, k):
+    """
+    Return the indices of the k highest scores, highest first.
+    """
+    top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def rescore(vectors, query, candidates, k):
+    """
+    Rescore candidate rows at full precision and keep the best k.
+
+    Parameters:
+    vectors (np.array): The (rows, dimensions) normalized float32 matrix, possibly memory-mapped.
+    query (np.array): The normalized float32 query.
+    candidates (np.array): The row indices retrieved from the compact representation.
+    k (int): The number of rows to keep.
+
+    Returns:
+    Tuple[np.array, np.array]: The kept row indices, closest first, and their cosine similarities.
+    """
+    # Reading rows in file order keeps page faults on the memory-mapped matrix sequential
+    candidates = np.sort(candidates)
+    scores = np.asarray(vectors[candidates]) @ query
+    best = top_k(scores, k)
+    return candidates[best], scores[best]
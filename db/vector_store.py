@@ -0,0 +1,322 @@
+import os
+import threading
+from abc import ABC
+from abc import abstractmethod
+
+from db import db_methods
+from db.binary_copy import binary_pg_insert
+from db.index_build import drop_index_concurrently
+from db.index_build import get_index_definition
+from db.index_build import restore_index
+
+# "pgvector" stores everything in PostgreSQL; "local" uses the in-process ANN index in db/ann_index.py
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pgvector")
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", "local_index")
+
+_store = None
+_store_lock = threading.Lock()
+
+
+class VectorStore(ABC):
+    """
+    Storage for books, their embedded chunks and the bookkeeping ingestion needs.
+    Chunk search results are (book_title, chunk_text, distance, begin_offset) rows and book search results are
+    (book_title, centroid, distance) rows, with cosine distance, as returned by the pgvector queries.
+    """
+
+    @abstractmethod
+    def insert_book(self, title, text):
+        """
+        Insert a book's text unless a book with this title already exists.
+
+        Returns:
+        bool: True if the book was inserted.
+        """
+
+    @abstractmethod
+    def add_book_text_part(self, title, part_number, text):
+        """
+        Store the next consecutive part of a book's text without rewriting the parts before it.
+        The book's text does not change until assemble_book_text.
+        """
+
+    @abstractmethod
+    def assemble_book_text(self, title):
+        """
+        Replace a book's text with its parts, in order, and discard the parts.
+        """
+
+    @abstractmethod
+    def replace_book(self, title, text):
+        """
+        Insert a book, or replace its text and remove its chunks if it already exists.
+        """
+
+    @abstractmethod
+    def replace_document(self, title, text, chunks, chunk_numbers, begin_offsets, embeddings):
+        """
+        Replace a book's text, chunks and centroid atomically: searches never see the book without its chunks.
+        """
+
+    @abstractmethod
+    def delete_book(self, title):
+        """
+        Remove a book and its chunks.
+        """
+
+    @abstractmethod
+    def insert_chunks(self, title, chunks, chunk_numbers, begin_offsets, embeddings):
+        """
+        Add embedded chunks of a book.
+        """
+
+    @abstractmethod
+    def refresh_book(self, title):
+        """
+        Recompute a book's centroid after its chunks changed.
+        """
+
+    @abstractmethod
+    def book_chunk_embeddings(self, title):
+        """
+        Return the (chunk_text, embedding) pairs stored for a book.
+        """
+
+    @abstractmethod
+    def get_book_text(self, title):
+        """
+        Return the full text of a book.
+        """
+
+    def get_text_windows(self, windows, max_overlap=0):
+        """
+        Return the text around positions in the books, given (title, start, end) character ranges, empty for
+        missing books. Stores that can find a window without reading the whole book override this, rebuilding it
+        from chunks that share at most max_overlap characters; by default each distinct book is read once and sliced.
+        """
+        texts = {}
+        slices = []
+        for title, start, end in windows:
+            if title not in texts:
+                try:
+                    texts[title] = self.get_book_text(title)
+                except FileNotFoundError:
+                    texts[title] = ""
+            slices.append(texts[title][start:end])
+        return slices
+
+    @abstractmethod
+    def query_chunks(self, embedding, top_n=5, ef_search=None, probes=None):
+        """
+        Return the top_n chunks closest to the embedding.
+        ef_search and probes trade speed for recall on stores with an HNSW or inverted-list index; None uses the
+        configured defaults.
+        """
+
+    @abstractmethod
+    def query_books(self, embedding, top_n=5, ef_search=None):
+        """
+        Return the top_n books whose centroid is closest to the embedding.
+        """
+
+    def query_chunks_batch(self, embeddings, top_n=5, ef_search=None, probes=None):
+        """
+        Return the top_n chunks closest to each embedding. Stores that can answer several queries at once override this.
+        """
+        return [self.query_chunks(embedding, top_n, ef_search, probes) for embedding in embeddings]
+
+    def query_books_batch(self, embeddings, top_n=5, ef_search=None):
+        """
+        Return the top_n books closest to each embedding.
+        """
+        return [self.query_books(embedding, top_n, ef_search) for embedding in embeddings]
+
+    @abstractmethod
+    def iter_chunk_embeddings(self, batch_size=10000):
+        """
+        Stream every stored chunk with its embedding.
+        Yields the number of chunks and the corpus generation first, then batches of
+        (book_title, chunk_text, begin_offset, embedding) rows.
+        """
+
+    @abstractmethod
+    def get_corpus_generation(self):
+        """
+        Return a counter that changes whenever the stored corpus changes.
+        """
+
+    @abstractmethod
+    def bump_corpus_generation(self):
+        """
+        Record that the corpus changed and return the new generation.
+        """
+
+    @abstractmethod
+    def manifest_entries(self):
+        """
+        Return the ingestion manifest as
+        {source_path: (book_title, content_hash, model_name, chunk_length, chunk_overlap, chunker)}.
+        """
+
+    @abstractmethod
+    def upsert_manifest_entry(self, source_path, book_title, content_hash, model_name, chunk_length, chunk_overlap, chunker):
+        """
+        Record that a source file has been ingested.
+        """
+
+    @abstractmethod
+    def delete_manifest_entry(self, source_path):
+        """
+        Remove a source file from the ingestion manifest.
+        """
+
+    @abstractmethod
+    def clear(self):
+        """
+        Remove every book, chunk and manifest entry.
+        """
+
+    @abstractmethod
+    def drop(self):
+        """
+        Remove the storage itself.
+        """
+
+    def snapshot(self):
+        """
+        Persist everything added so far. A no-op for stores that persist on every write.
+        """
+
+    def begin_bulk_load(self):
+        """
+        Prepare for a large load, for example by deferring index maintenance. A no-op by default.
+        """
+
+    def end_bulk_load(self):
+        """
+        Finish a large load started with begin_bulk_load. A no-op by default.
+        """
+
+
+class PgVectorStore(VectorStore):
+    """
+    Vector store backed by PostgreSQL with pgvector, using the functions in db_methods.
+    """
+
+    def __init__(self):
+        self._deferred_index = None
+
+    def insert_book(self, title, text):
+        return db_methods.insert_book(title, text)
+
+    def add_book_text_part(self, title, part_number, text):
+        db_methods.insert_book_text_part(title, part_number, text)
+
+    def assemble_book_text(self, title):
+        db_methods.assemble_book_text(title)
+
+    def replace_book(self, title, text):
+        db_methods.replace_book(title, text)
+
+    def replace_document(self, title, text, chunks, chunk_numbers, begin_offsets, embeddings):
+        db_methods.replace_book_with_chunks(title, text, chunks, chunk_numbers, begin_offsets, embeddings)
+
+    def delete_book(self, title):
+        db_methods.delete_book(title)
+
+    def insert_chunks(self, title, chunks, chunk_numbers, begin_offsets, embeddings):
+        binary_pg_insert(title, chunks, chunk_numbers, begin_offsets, embeddings)
+
+    def refresh_book(self, title):
+        db_methods.refresh_book_centroid(title)
+
+    def book_chunk_embeddings(self, title):
+        return db_methods.get_book_chunk_embeddings(title)
+
+    def get_book_text(self, title):
+        return db_methods.get_book_text_by_title(title)
+
+    def get_text_windows(self, windows, max_overlap=0):
+        return db_methods.get_book_text_windows(windows, max_overlap)
+
+    def query_chunks(self, embedding, top_n=5, ef_search=None, probes=None):
+        return db_methods.query_similar_chunks(embedding, top_n, ef_search, probes)
+
+    def query_books(self, embedding, top_n=5, ef_search=None):
+        return db_methods.query_similar_books(embedding, top_n, ef_search)
+
+    def query_chunks_batch(self, embeddings, top_n=5, ef_search=None, probes=None):
+        return db_methods.query_similar_chunks_batch(embeddings, top_n, ef_search, probes)
+
+    def query_books_batch(self, embeddings, top_n=5, ef_search=None):
+        return db_methods.query_similar_books_batch(embeddings, top_n, ef_search)
+
+    def iter_chunk_embeddings(self, batch_size=10000):
+        return db_methods.iter_chunk_embeddings(batch_size)
+
+    def get_corpus_generation(self):
+        return db_methods.get_corpus_generation()
+
+    def bump_corpus_generation(self):
+        return db_methods.bump_corpus_generation()
+
+    def manifest_entries(self):
+        db_methods.initialize_ingest_manifest_table()
+        return db_methods.get_manifest_entries()
+
+    def upsert_manifest_entry(self, source_path, book_title, content_hash, model_name, chunk_length, chunk_overlap, chunker):
+        db_methods.upsert_manifest_entry(source_path, book_title, content_hash, model_name, chunk_length, chunk_overlap, chunker)
+
+    def delete_manifest_entry(self, source_path):
+        db_methods.delete_manifest_entry(source_path)
+
+    def clear(self):
+        db_methods.remove_index()
+        db_methods.clear_embeddings()
+        db_methods.clear_book_centroids()
+        db_methods.clear_books()
+        db_methods.clear_ingest_manifest()
+        db_methods.clear_chunk_store()
+
+    def begin_bulk_load(self):
+        # Inserting into an HNSW index is most of the cost of a large load; searches fall back to exact scans
+        self._deferred_index = get_index_definition()
+        if self._deferred_index is not None:
+            drop_index_concurrently()
+
+    def end_bulk_load(self):
+        definition, self._deferred_index = self._deferred_index, None
+        if definition is not None:
+            print("Rebuilding the chunk index...")
+            restore_index(definition)
+
+    def drop(self):
+        db_methods.drop_book_embeddings()
+        db_methods.drop_book_centroids()
+        db_methods.drop_books_table()
+        db_methods.drop_ingest_manifest()
+        db_methods.drop_chunk_store()
+
+
+def get_vector_store():
+    """
+    Get the process-wide vector store selected by VECTOR_BACKEND.
+
+    Parameters:
+    None
+
+    Returns:
+    VectorStore: The configured vector store.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            if VECTOR_BACKEND == "pgvector":
+                _store = PgVectorStore()
+            elif VECTOR_BACKEND == "local":
+                from db.ann_index import LocalAnnStore
+
+                _store = LocalAnnStore(LOCAL_INDEX_PATH)
+            else:
+                raise ValueError(f"Unknown VECTOR_BACKEND: {VECTOR_BACKEND}")
+        return _store
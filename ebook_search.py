@@ -3,44 +3,56 @@ import os
 import warnings
 
 from dotenv import load_dotenv
-from tqdm import tqdm
 
+from db.db_methods import HNSW_EF_CONSTRUCTION
+from db.db_methods import HNSW_M
+from db.db_methods import HNSW_MAX_EF_SEARCH
+from db.db_methods import INDEX_TYPE
+from db.db_methods import IVFFLAT_LISTS
 from srv.ebook_services import clear_db
 from srv.ebook_services import delete_table
+from srv.ebook_services import document_title
+from srv.ebook_services import export_matrix
 from srv.ebook_services import get_database_size
 from srv.ebook_services import init_index
 from srv.ebook_services import init_table
 from srv.ebook_services import insert_doc_to_db
+from srv.ebook_services import insert_text_to_db
 from srv.ebook_services import query_database
+from srv.ebook_services import query_database_batch
 from srv.ebook_services import reindex
-from utils.epub2txt import epub2txt
-from utils.pdf2txt import pdf2txt
+from srv.ingest_pipeline import ingest_directory
+from utils.epub2txt import epub_to_text
+from utils.pdf2txt import PDF_BACKEND
+from utils.pdf2txt import PDF_BACKENDS
+from utils.pdf2txt import iter_pdf_text
+from utils.pdf2txt import pdf_to_text
 
 
-def insert_pdf_to_db(pdf_path: str, verbose: bool = False) -> None:
+def insert_pdf_to_db(pdf_path: str, verbose: bool = False, stream: bool = False, backend: str = PDF_BACKEND) -> None:
     if verbose:
-        print("Converting PDF to TXT...")
-    txt_path = pdf2txt(pdf_path)
-    if verbose:
-        print(f"Successfully converted {pdf_path} to {txt_path}")
-    insert_doc_to_db(txt_path, verbose=verbose)
+        print("Extracting text from PDF...")
+    # When streaming, pages are chunked and embedded while later ones are still being extracted
+    text = iter_pdf_text(pdf_path, backend) if stream else pdf_to_text(pdf_path, backend)
+    insert_text_to_db(document_title(pdf_path), text, verbose=verbose, stream=stream)
     print("Added document to database.")
-    os.remove(txt_path)
-    if verbose:
-        print(f"Temporary file {txt_path} deleted.")
 
 
-def insert_epub_to_db(epub_path: str, verbose: bool = False) -> None:
-    if verbose:
-        print("Converting EPUB to TXT...")
-    txt_path = epub2txt(epub_path)
+def insert_epub_to_db(epub_path: str, verbose: bool = False, stream: bool = False) -> None:
     if verbose:
-        print(f"Successfully converted {epub_path} to {txt_path}")
-    insert_doc_to_db(txt_path, verbose=verbose)
+        print("Extracting text from EPUB...")
+    insert_text_to_db(document_title(epub_path), epub_to_text(epub_path), verbose=verbose, stream=stream)
     print("Added document to database.")
-    os.remove(txt_path)
-    if verbose:
-        print(f"Temporary file {txt_path} deleted.")
+
+
+def print_results(results, books: bool = False) -> None:
+    print(f"Found {len(results)} results:")
+    if books:
+        for result in results:
+            print(f"Document: {result['title']}\nDistance: {result['similarity']}\n")
+    else:
+        for result in results:
+            print(f"Document: {result['title']} Distance: {result['similarity']}\nContent: {result['text']}\n")
 
 
 def main():
@@ -58,6 +70,25 @@ def main():
         action="store_true",
         help="Recreate the index on the embeddings column",
     )
+    parser.add_argument(
+        "--index-type",
+        choices=["hnsw", "ivfflat"],
+        default=INDEX_TYPE,
+        help="Index built by --index and --reindex",
+    )
+    parser.add_argument("--m", type=int, default=HNSW_M, help="Maximum connections per HNSW layer")
+    parser.add_argument(
+        "--ef-construction",
+        type=int,
+        default=HNSW_EF_CONSTRUCTION,
+        help="Candidate list size while building an HNSW index",
+    )
+    parser.add_argument(
+        "--lists",
+        type=int,
+        default=IVFFLAT_LISTS,
+        help="Number of IVFFlat lists, 0 chooses it from the number of chunks",
+    )
     parser.add_argument("-t", "--table", action="store_true", help="Create the tables in the database")
     parser.add_argument(
         "-x",
@@ -66,8 +97,41 @@ def main():
         help="Drop the tables in the database",
     )
     parser.add_argument("-a", "--add", type=str, help="Add a document to the database")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Add the document in fixed-size windows so memory use does not grow with its size",
+    )
+    parser.add_argument(
+        "--pdf-backend",
+        choices=PDF_BACKENDS,
+        default=PDF_BACKEND,
+        help="Text extraction backend for an added PDF; pypdfium2 is faster, pdfplumber keeps more of the layout",
+    )
     parser.add_argument("-d", "--dir", type=str, help="Add all files in a directory to the database")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=max(1, (os.cpu_count() or 2) // 2),
+        help="Number of processes extracting text in parallel when adding a directory",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="When adding a directory, remove books whose source file was deleted from it",
+    )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="When adding a directory, drop the chunk index during the load and rebuild it concurrently afterwards",
+    )
     parser.add_argument("-q", "--query", type=str, help="Query the database with a question")
+    parser.add_argument(
+        "--query-file",
+        type=str,
+        help="Query the database with every line of a file, embedding and searching them as one batch",
+    )
     parser.add_argument("-e", "--extended", action="store_true", help="Flag for extended query option")
     parser.add_argument(
         "-b",
@@ -82,10 +146,25 @@ def main():
         default=5,
         help="Number of results to return for a query",
     )
+    parser.add_argument(
+        "--export-matrix",
+        action="store_true",
+        help="Export the chunk embeddings to a memory-mapped matrix for exact search",
+    )
+    parser.add_argument(
+        "--ef-search",
+        type=int,
+        help="HNSW candidate list size for a query; higher is slower but more accurate",
+    )
+    parser.add_argument("--probes", type=int, help="Number of IVFFlat lists scanned for a query")
     parser.add_argument("-s", "--data-size", action="store_true", help="Print the size of the database")
     parser.add_argument("-v", "--verbose", action="store_true", help="Print verbose output")
 
     args = parser.parse_args()
+    if args.ef_search is not None and not 1 <= args.ef_search <= HNSW_MAX_EF_SEARCH:
+        parser.error(f"--ef-search must be between 1 and {HNSW_MAX_EF_SEARCH}")
+    if args.probes is not None and args.probes < 1:
+        parser.error("--probes must be at least 1")
 
     if args.clear:
         confirmation = input("Are you sure you want to clear the database? This action cannot be undone. (y/n): ")
@@ -96,11 +175,11 @@ def main():
         return
 
     if args.index:
-        init_index()
+        init_index(args.index_type, args.m, args.ef_construction, args.lists)
         return
 
     if args.reindex:
-        reindex()
+        reindex(args.index_type, args.m, args.ef_construction, args.lists)
         return
 
     if args.table:
@@ -118,40 +197,37 @@ def main():
     if args.add:
         if os.path.isfile(args.add):
             if args.add.endswith(".epub"):
-                insert_epub_to_db(args.add, verbose=args.verbose)
+                insert_epub_to_db(args.add, verbose=args.verbose, stream=args.stream)
             elif args.add.endswith(".pdf"):
-                insert_pdf_to_db(args.add, verbose=args.verbose)
+                insert_pdf_to_db(args.add, verbose=args.verbose, stream=args.stream, backend=args.pdf_backend)
             elif args.add.endswith(".txt"):
-                insert_doc_to_db(args.add, verbose=args.verbose)
+                insert_doc_to_db(args.add, verbose=args.verbose, stream=args.stream)
         return
 
     if args.dir:
-        files = [file for file in os.listdir(args.dir)]
-        progress_bar = tqdm(files, desc="Processing files", unit="file")
-        for file in progress_bar:
-            progress_bar.set_description(f"Processing {file}")
-            if file.endswith(".epub"):
-                txt_path = epub2txt(os.path.join(args.dir, file))
-            elif file.endswith(".pdf"):
-                txt_path = pdf2txt(os.path.join(args.dir, file))
-            elif file.endswith(".txt"):
-                txt_path = os.path.join(args.dir, file)
-            else:
-                continue
-            insert_doc_to_db(txt_path)
-            os.remove(txt_path)
+        ingest_directory(args.dir, args.workers, args.prune, args.bulk)
         return
 
     if args.query:
-        results = query_database(args.query, args.num_results, args.verbose, args.book, args.extended)
-        print(f"Found {len(results)} results:")
-        if args.book:
-            for result in results:
-                print(f"Document: {result['title']}\nDistance: {result['similarity']}\n")
-            return
-        else:
-            for result in results:
-                print(f"Document: {result['title']} Distance: {result['similarity']}\nContent: {result['text']}\n")
+        results = query_database(
+            args.query, args.num_results, args.verbose, args.book, args.extended, args.ef_search, args.probes
+        )
+        print_results(results, args.book)
+        return
+
+    if args.query_file:
+        with open(args.query_file, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+        batch_results = query_database_batch(
+            queries, args.num_results, args.verbose, args.book, args.extended, args.ef_search, args.probes
+        )
+        for query, results in zip(queries, batch_results):
+            print(f"Query: {query}")
+            print_results(results, args.book)
+        return
+
+    if args.export_matrix:
+        export_matrix()
         return
 
     if args.data_size:
@@ -0,0 +1,239 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db.pool import run_in_pool
+from srv.ebook_services import ENCODER_BATCHING
+from srv.ebook_services import MODEL_NAME
+from srv.ebook_services import cache_results
+from srv.ebook_services import embed_queries
+from srv.ebook_services import embed_query
+from srv.ebook_services import find_similar
+from srv.ebook_services import format_result
+from srv.ebook_services import format_results
+from srv.ebook_services import get_cached_results
+from srv.ebook_services import get_cached_results_batch
+from srv.ebook_services import get_query_batcher
+from srv.ebook_services import query_cache
+from srv.ebook_services import search_by_embedding
+from srv.ebook_services import search_by_embeddings
+
+# Threads available for model inference; torch already parallelises each encode internally
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", "2"))
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "10"))
+MAX_CONCURRENT_SEARCHES = int(os.getenv("MAX_CONCURRENT_SEARCHES", "256"))
+BATCH_SEARCH_TIMEOUT = float(os.getenv("BATCH_SEARCH_TIMEOUT", "120"))
+# Extended stream results whose context is read in one query; the first group is sent before the next is read
+STREAM_CONTEXT_GROUP = int(os.getenv("STREAM_CONTEXT_GROUP", "4"))
+
+_encode_executor = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="encode")
+# The SQLite tier of the query cache blocks on disk and on other workers' locks, so it never runs on the event loop
+_cache_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="query-cache")
+_search_slots = None
+
+
+def _get_search_slots():
+    # Created lazily so the semaphore binds to the running event loop
+    global _search_slots
+    if _search_slots is None:
+        _search_slots = asyncio.Semaphore(MAX_CONCURRENT_SEARCHES)
+    return _search_slots
+
+
+async def embed_query_async(query):
+    """
+    Embed a query string without blocking the event loop.
+    With ENCODER_BATCHING the query goes straight to the micro-batcher so concurrent requests share one encode call;
+    otherwise it runs on the bounded encoder thread pool.
+
+    Parameters:
+    query (str): The text to embed.
+
+    Returns:
+    List[float]: The query embedding.
+    """
+    if not ENCODER_BATCHING:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_encode_executor, embed_query, query)
+    embedding = query_cache.get_memory(MODEL_NAME, query)
+    if embedding is not None:
+        return embedding
+    loop = asyncio.get_running_loop()
+    if query_cache.path:
+        embedding = await loop.run_in_executor(_cache_executor, query_cache.get_disk, MODEL_NAME, query)
+    else:
+        embedding = query_cache.get_disk(MODEL_NAME, query)
+    if embedding is None:
+        embedding = await asyncio.wrap_future(get_query_batcher().submit(query))
+        created = time.time()
+        query_cache.put_memory(MODEL_NAME, query, embedding, created)
+        if query_cache.path:
+            # Written in the background; the response does not wait for the disk tier
+            loop.run_in_executor(_cache_executor, query_cache.put_disk, MODEL_NAME, query, embedding, created)
+    return embedding
+
+
+async def _query_database_async(query, n, books, extended, ef_search, probes):
+    results, generation = await run_in_pool(get_cached_results, query, n, books, extended, ef_search, probes)
+    if results is not None:
+        return results
+    query_embedding = await embed_query_async(query)
+    results = await run_in_pool(search_by_embedding, query_embedding, n, books, extended, ef_search, probes)
+    cache_results(query, n, books, extended, generation, results, ef_search, probes)
+    return results
+
+
+async def query_database_async(query, n=5, books=False, extended=False, timeout=SEARCH_TIMEOUT, ef_search=None, probes=None):
+    """
+    Query the database without blocking the event loop.
+    At most MAX_CONCURRENT_SEARCHES searches run at once; the rest wait for a slot within the same timeout.
+
+    Parameters:
+    query (str): The text to search for in the database.
+    n (int): The number of results to return.
+    books (bool): Whether to search whole books instead of text chunks.
+    extended (bool): Whether to return the text surrounding each matching chunk.
+    timeout (float): Seconds to wait for a slot, the embedding and the database lookup combined.
+    ef_search (int): The HNSW candidate list size, or None for the default.
+    probes (int): The number of IVFFlat lists to scan, or None for the default.
+
+    Returns:
+    List[Dict]: A list of dictionaries with the title, text and similarity of each result.
+
+    Raises:
+    asyncio.TimeoutError: If the search did not finish within the timeout.
+    """
+
+    async def _run():
+        async with _get_search_slots():
+            return await _query_database_async(query, n, books, extended, ef_search, probes)
+
+    return await asyncio.wait_for(_run(), timeout)
+
+
+async def _stream_results(query, n, books, extended, ef_search, probes, cached, rows, generation, deadline):
+    if cached is not None:
+        for result in cached:
+            yield result
+        return
+    if not extended or books:
+        # Only extended results read book text; the rest are formatted in place
+        results = [format_result(row, books, extended) for row in rows]
+        for result in results:
+            yield result
+        cache_results(query, n, books, extended, generation, results, ef_search, probes)
+        return
+
+    async def _resolve(group):
+        async with _get_search_slots():
+            return await run_in_pool(format_results, group, books, extended)
+
+    loop = asyncio.get_running_loop()
+    results = []
+    for start in range(0, len(rows), STREAM_CONTEXT_GROUP):
+        # Each group holds a search slot and a pool connection for one query, within what is left of the timeout
+        group = await asyncio.wait_for(_resolve(rows[start : start + STREAM_CONTEXT_GROUP]), max(0.0, deadline - loop.time()))
+        results.extend(group)
+        for result in group:
+            yield result
+    cache_results(query, n, books, extended, generation, results, ef_search, probes)
+
+
+async def stream_query_database_async(
+    query, n=5, books=False, extended=False, timeout=SEARCH_TIMEOUT, ef_search=None, probes=None
+):
+    """
+    Query the database and stream the results as they are resolved, rather than all at once.
+    The embedding and nearest-neighbour lookup finish within the timeout before this returns, so a slow search
+    still fails before anything is streamed. Extended context is read while iterating, STREAM_CONTEXT_GROUP results
+    per query, each group in a search slot and within what is left of the same timeout.
+
+    Parameters:
+    query (str): The text to search for in the database.
+    n (int): The number of results to return.
+    books (bool): Whether to search whole books instead of text chunks.
+    extended (bool): Whether to return the text surrounding each matching chunk.
+    timeout (float): Seconds to wait for a slot, the embedding and the lookup combined.
+    ef_search (int): The HNSW candidate list size, or None for the default.
+    probes (int): The number of IVFFlat lists to scan, or None for the default.
+
+    Returns:
+    AsyncIterator[Dict]: The results, closest first.
+
+    Raises:
+    asyncio.TimeoutError: If the lookup did not finish within the timeout. Raised while iterating instead if
+    reading the extended context runs past it, which ends the stream early.
+    """
+    deadline = asyncio.get_running_loop().time() + timeout
+
+    async def _find():
+        async with _get_search_slots():
+            cached, generation = await run_in_pool(get_cached_results, query, n, books, extended, ef_search, probes)
+            if cached is not None:
+                return cached, None, generation
+            query_embedding = await embed_query_async(query)
+            rows = await run_in_pool(find_similar, query_embedding, n, books, ef_search, probes)
+            return None, rows, generation
+
+    cached, rows, generation = await asyncio.wait_for(_find(), timeout)
+    return _stream_results(query, n, books, extended, ef_search, probes, cached, rows, generation, deadline)
+
+
+async def _query_database_batch_async(queries, n, books, extended, ef_search, probes):
+    results, generation = await run_in_pool(get_cached_results_batch, queries, n, books, extended, ef_search, probes)
+    misses = [i for i, cached in enumerate(results) if cached is None]
+    if not misses:
+        return results
+    # One encode call for the whole batch, rather than many small ones through the micro-batcher
+    loop = asyncio.get_running_loop()
+    embeddings = await loop.run_in_executor(_encode_executor, embed_queries, [queries[i] for i in misses])
+    found = await run_in_pool(search_by_embeddings, embeddings, n, books, extended, ef_search, probes)
+    for i, query_results in zip(misses, found):
+        results[i] = query_results
+        cache_results(queries[i], n, books, extended, generation, query_results, ef_search, probes)
+    return results
+
+
+async def query_database_batch_async(
+    queries, n=5, books=False, extended=False, timeout=BATCH_SEARCH_TIMEOUT, ef_search=None, probes=None
+):
+    """
+    Query the database for many texts without blocking the event loop, embedding them in one batch and looking
+    them up in one round trip. The whole batch takes a single search slot.
+
+    Parameters:
+    queries (List[str]): The texts to search for in the database.
+    n (int): The number of results to return per query.
+    books (bool): Whether to search whole books instead of text chunks.
+    extended (bool): Whether to return the text surrounding each matching chunk.
+    timeout (float): Seconds to wait for a slot, the embeddings and the database lookup combined.
+    ef_search (int): The HNSW candidate list size, or None for the default.
+    probes (int): The number of IVFFlat lists to scan, or None for the default.
+
+    Returns:
+    List[List[Dict]]: The results of each query, in order.
+
+    Raises:
+    asyncio.TimeoutError: If the batch did not finish within the timeout.
+    """
+
+    async def _run():
+        async with _get_search_slots():
+            return await _query_database_batch_async(queries, n, books, extended, ef_search, probes)
+
+    return await asyncio.wait_for(_run(), timeout)
+
+
+def shutdown_executors():
+    """
+    Shut down the encoder and query cache thread pools.
+
+    Parameters:
+    None
+
+    Returns:
+    None
+    """
+    _encode_executor.shutdown(wait=False)
+    _cache_executor.shutdown(wait=False)
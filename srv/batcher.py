@@ -0,0 +1,130 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Collect items submitted from many threads and process them in batches on a single worker thread.
+
+    A batch is dispatched as soon as it holds max_batch items, or max_wait seconds after its first item arrived,
+    whichever comes first. Each caller gets a Future resolved with the result for its own item.
+    """
+
+    def __init__(self, process_batch, max_batch=32, max_wait=0.003, name="micro-batcher"):
+        """
+        Parameters:
+        process_batch (Callable[[List], Sequence]): Function mapping a list of items to a same-length sequence of results.
+        max_batch (int): The largest number of items processed in one call.
+        max_wait (float): How long, in seconds, to hold a partial batch open for more items.
+        name (str): The name of the worker thread.
+        """
+        self.process_batch = process_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._full_batches = 0
+        self._busy_seconds = 0.0
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item):
+        """
+        Queue an item for the next batch.
+
+        Parameters:
+        item (Any): The item to process.
+
+        Returns:
+        concurrent.futures.Future: A future resolved with the result for this item.
+        """
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item):
+        """
+        Process a single item through the batcher, blocking until its batch has run.
+
+        Parameters:
+        item (Any): The item to process.
+
+        Returns:
+        Any: The result for this item.
+        """
+        return self.submit(item).result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Callers that timed out have cancelled their futures; skip their items, and never set a result on them
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._process(batch)
+            except Exception as e:
+                # A failing batch must not end the worker thread, or every later submit would wait forever
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _process(self, batch):
+        items = [item for item, _ in batch]
+        started = time.perf_counter()
+        try:
+            results = self.process_batch(items)
+        finally:
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._full_batches += len(batch) == self.max_batch
+                self._busy_seconds += time.perf_counter() - started
+        if len(results) != len(batch):
+            raise ValueError(f"process_batch returned {len(results)} results for {len(batch)} items")
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def stats(self):
+        """
+        Report how well batches are being filled.
+
+        Parameters:
+        None
+
+        Returns:
+        Dict: Batch and item counts, the mean batch size, the mean fill ratio against max_batch,
+        the share of batches that were full, the time spent processing and the current queue depth.
+        """
+        with self._stats_lock:
+            batches = self._batches
+            items = self._items
+            full_batches = self._full_batches
+            busy_seconds = self._busy_seconds
+        mean_batch = items / batches if batches else 0.0
+        return {
+            "batches": batches,
+            "items": items,
+            "mean_batch_size": mean_batch,
+            "mean_fill_ratio": mean_batch / self.max_batch,
+            "full_batch_ratio": full_batches / batches if batches else 0.0,
+            "busy_seconds": busy_seconds,
+            "queue_depth": self._queue.qsize(),
+        }
@@ -0,0 +1,190 @@
+import hashlib
+import threading
+
+import numpy as np
+
+from db.db_methods import get_chunk_store_size
+from db.db_methods import get_stored_chunk_embeddings
+from db.db_methods import initialize_chunk_store_table
+from db.db_methods import insert_stored_chunk_embeddings
+from db.db_methods import prune_chunk_store
+
+
+def chunk_hash(chunk):
+    """
+    Hash a chunk's normalized text so identical chunks share an embedding.
+
+    Parameters:
+    chunk (str): The chunk text.
+
+    Returns:
+    str: The hex SHA-256 digest of the whitespace-collapsed chunk.
+    """
+    return hashlib.sha256(" ".join(chunk.split()).encode("utf-8")).hexdigest()
+
+
+class ChunkEmbeddingStore:
+    """
+    Content-addressed store of chunk embeddings keyed by (model name, chunk hash), so boilerplate shared by many books
+    and text that survives re-chunking or a new edition is only embedded once.
+
+    The store holds a second copy of each distinct vector next to book_embeddings, whose column the chunk index is built
+    on, so it saves encoding time, not space. prune() keeps it to the chunks still in the corpus.
+    """
+
+    def __init__(self, model_name, enabled=True):
+        """
+        Parameters:
+        model_name (str): The model the stored embeddings belong to.
+        enabled (bool): Whether to look up and save embeddings in the database. Duplicates within a call are
+        always embedded once.
+        """
+        self.model_name = model_name
+        self.enabled = enabled
+        self._initialized = False
+        self._lock = threading.Lock()
+        self.chunks = 0
+        self.duplicates = 0
+        self.store_hits = 0
+        self.encoded = 0
+
+    def _ensure_table(self):
+        if not self._initialized:
+            initialize_chunk_store_table()
+            self._initialized = True
+
+    def lookup(self, hashes):
+        """
+        Fetch stored embeddings.
+
+        Parameters:
+        hashes (Iterable[str]): The chunk hashes to look up.
+
+        Returns:
+        Dict[str, np.array]: The embedding of every hash found.
+        """
+        hashes = list(hashes)
+        if not self.enabled or not hashes:
+            return {}
+        self._ensure_table()
+        return {
+            found_hash: np.asarray(embedding, dtype=np.float32)
+            for found_hash, embedding in get_stored_chunk_embeddings(self.model_name, hashes)
+        }
+
+    def save(self, hashes, embeddings):
+        """
+        Store newly computed embeddings.
+
+        Parameters:
+        hashes (List[str]): The hash of each chunk.
+        embeddings (np.array): One embedding per chunk.
+
+        Returns:
+        None
+        """
+        if not self.enabled or not len(hashes):
+            return
+        self._ensure_table()
+        insert_stored_chunk_embeddings(self.model_name, hashes, embeddings)
+
+    def prune(self):
+        """
+        Drop stored embeddings that no book references any more.
+
+        Parameters:
+        None
+
+        Returns:
+        int: The number of embeddings dropped.
+        """
+        if not self.enabled:
+            return 0
+        self._ensure_table()
+        return prune_chunk_store()
+
+    def storage(self):
+        """
+        Report the space the store takes next to the chunk table.
+
+        Parameters:
+        None
+
+        Returns:
+        Dict: The number of stored embeddings, the sizes in bytes of the store and of the chunk table, and the
+        store's size as a share of the chunk table's, or an empty dictionary if the store is disabled.
+        """
+        if not self.enabled:
+            return {}
+        self._ensure_table()
+        rows, store_bytes, chunk_bytes = get_chunk_store_size()
+        return {
+            "rows": rows,
+            "store_bytes": store_bytes,
+            "chunk_table_bytes": chunk_bytes,
+            "overhead_ratio": store_bytes / chunk_bytes if chunk_bytes else 0.0,
+        }
+
+    def embed(self, chunks, encode):
+        """
+        Embed chunks, encoding each distinct chunk that is not already stored exactly once.
+
+        Parameters:
+        chunks (List[str]): The chunks to embed.
+        encode (Callable[[List[str]], np.array]): Function computing embeddings for a list of chunks.
+
+        Returns:
+        np.array: One embedding per chunk, in order.
+        """
+        hashes = [chunk_hash(chunk) for chunk in chunks]
+        first_index = {}
+        for i, digest in enumerate(hashes):
+            first_index.setdefault(digest, i)
+        known = self.lookup(first_index.keys())
+        missing = [digest for digest in first_index if digest not in known]
+        if missing:
+            encoded = np.asarray(encode([chunks[first_index[digest]] for digest in missing]), dtype=np.float32)
+            self.save(missing, encoded)
+            known.update(zip(missing, encoded))
+        self.record(len(chunks), len(chunks) - len(first_index), len(first_index) - len(missing), len(missing))
+        if not chunks:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([known[digest] for digest in hashes])
+
+    def record(self, chunks, duplicates, store_hits, encoded):
+        """
+        Add to the dedup counters.
+
+        Parameters:
+        chunks (int): The number of chunks embedded.
+        duplicates (int): How many repeated an earlier chunk in the same call.
+        store_hits (int): How many distinct chunks were found in the store.
+        encoded (int): How many distinct chunks had to be encoded.
+
+        Returns:
+        None
+        """
+        with self._lock:
+            self.chunks += chunks
+            self.duplicates += duplicates
+            self.store_hits += store_hits
+            self.encoded += encoded
+
+    def stats(self):
+        """
+        Report how much encoding the store saved.
+
+        Parameters:
+        None
+
+        Returns:
+        Dict: The chunk, duplicate, store hit and encoded counts, and the dedup ratio (share of chunks not encoded).
+        """
+        with self._lock:
+            return {
+                "chunks": self.chunks,
+                "duplicates": self.duplicates,
+                "store_hits": self.store_hits,
+                "encoded": self.encoded,
+                "dedup_ratio": 1 - self.encoded / self.chunks if self.chunks else 0.0,
+            }
@@ -0,0 +1,262 @@
+import os
+import re
+from abc import ABC
+from abc import abstractmethod
+
+import numpy as np
+
+# "characters" cuts fixed windows of CHUNK_LENGTH characters; "tokens" packs whole sentences into the model's
+# token window, preferring to end chunks at paragraph breaks
+CHUNKER = os.getenv("CHUNKER", "characters")
+CHUNK_LENGTH = int(os.getenv("CHUNK_LENGTH", "500"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
+# Tokens per chunk for the token chunker; 0 fills the model's max_seq_length
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "0"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+# Sentences tokenized per tokenizer call
+TOKENIZE_BATCH = int(os.getenv("TOKENIZE_BATCH", "4096"))
+# Characters a subword token rarely exceeds, to bound the text chunks of the token chunker share
+_MAX_TOKEN_CHARS = 16
+
+CHUNKERS = ("characters", "tokens")
+if CHUNKER not in CHUNKERS:
+    raise ValueError(f"CHUNKER must be characters or tokens, got {CHUNKER}")
+
+# A blank line ends a paragraph; ., ! or ?, optionally followed by closing quotes or brackets, then whitespace
+# ends a sentence
+_BOUNDARY = re.compile(r"(?P<paragraph>\n[^\S\n]*\n)\s*|(?<=[.!?])[\"'”’)\]]*(?P<space>\s+)")
+
+
+class Chunker(ABC):
+    """
+    Splits a text into the chunks that are embedded. Chunks are returned with whitespace collapsed, together with the
+    exact offset of each chunk in the source text, so context windows and highlights line up with the stored book.
+    """
+
+    name = None
+
+    def spans(self, text):
+        """
+        Return the (start, end) character range of each chunk of text, in order.
+        """
+        return self.partial_spans(text, final=True)[0]
+
+    @abstractmethod
+    def partial_spans(self, text, final=False):
+        """
+        Chunk the beginning of a longer text that is still arriving.
+        Returns the spans that more text cannot change and the offset to chunk again from once it has arrived;
+        with final=True the text is complete and every span is returned.
+        """
+
+    @abstractmethod
+    def settings(self):
+        """
+        Return the (length, overlap, name) recorded in the ingestion manifest; chunks change when any of them does.
+        """
+
+    def chunk(self, text):
+        """
+        Split a text into chunks.
+
+        Parameters:
+        text (str): The text to split.
+
+        Returns:
+        Tuple[List[str], List[int]]: The whitespace-collapsed chunks and the offset of each in text.
+        """
+        spans = self.spans(text)
+        return [" ".join(text[start:end].split()) for start, end in spans], [start for start, _ in spans]
+
+
+class CharacterChunker(Chunker):
+    """
+    Fixed windows of length characters, each starting length - overlap characters after the previous one.
+    """
+
+    name = "characters"
+
+    def __init__(self, length=CHUNK_LENGTH, overlap=CHUNK_OVERLAP):
+        self.length = length
+        self.overlap = overlap
+
+    def partial_spans(self, text, final=False):
+        starts = range(0, len(text), self.length - self.overlap)
+        if not final:
+            # Only windows that are already complete
+            starts = [start for start in starts if start + self.length <= len(text)]
+        spans = [(start, min(start + self.length, len(text))) for start in starts]
+        resume = spans[-1][0] + self.length - self.overlap if spans else 0
+        return spans, len(text) if final else resume
+
+    def settings(self):
+        return self.length, self.overlap, self.name
+
+
+class TokenChunker(Chunker):
+    """
+    Chunks of whole sentences that fit in a token budget, counted with the embedding model's own tokenizer, so chunks
+    neither overflow the model's window and get truncated nor leave most of it as padding.
+    A chunk ends at the last paragraph break that still fills half the budget. Consecutive chunks share trailing
+    sentences of up to overlap tokens. Sentences longer than the budget are cut at token boundaries, which needs a fast
+    tokenizer for its offset mapping.
+    """
+
+    name = "tokens"
+
+    def __init__(self, tokenizer, max_tokens, overlap=CHUNK_OVERLAP_TOKENS, batch_size=TOKENIZE_BATCH):
+        """
+        Parameters:
+        tokenizer (PreTrainedTokenizerFast): The tokenizer of the embedding model.
+        max_tokens (int): The token budget of a chunk, without special tokens.
+        overlap (int): The most tokens consecutive chunks share.
+        batch_size (int): The number of sentences tokenized per call.
+        """
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap = min(overlap, max_tokens // 2)
+        self.batch_size = batch_size
+
+    def settings(self):
+        return self.max_tokens, self.overlap, self.name
+
+    def _sentences(self, text):
+        """
+        Find the sentences of a text.
+
+        Returns:
+        Tuple[List[int], List[int], List[bool]]: The start and end of each sentence and whether a paragraph ends there.
+        """
+        starts, ends, paragraph_ends = [], [], []
+        start = len(text) - len(text.lstrip())
+        for match in _BOUNDARY.finditer(text, start):
+            end = match.start("paragraph") if match.group("paragraph") else match.start("space")
+            if end > start:
+                starts.append(start)
+                ends.append(end)
+                paragraph_ends.append(bool(match.group("paragraph")))
+            start = match.end()
+        if start < len(text):
+            starts.append(start)
+            ends.append(len(text))
+            paragraph_ends.append(True)
+        return starts, ends, paragraph_ends
+
+    def _count_tokens(self, pieces):
+        lengths = []
+        for i in range(0, len(pieces), self.batch_size):
+            encoded = self.tokenizer(
+                pieces[i : i + self.batch_size],
+                add_special_tokens=False,
+                return_attention_mask=False,
+                return_token_type_ids=False,
+            )
+            lengths.extend(len(ids) for ids in encoded["input_ids"])
+        return lengths
+
+    def _split_long(self, text, start, end):
+        # Cut a sentence longer than the budget into pieces of max_tokens tokens
+        offsets = self.tokenizer(text[start:end], add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        pieces = []
+        for i in range(0, len(offsets), self.max_tokens):
+            piece = offsets[i : i + self.max_tokens]
+            pieces.append((start + piece[0][0], start + piece[-1][1], len(piece)))
+        return pieces
+
+    def partial_spans(self, text, final=False):
+        starts, ends, paragraph_ends = self._sentences(text)
+        if not starts:
+            return [], len(text) if final else len(text) - len(text.lstrip())
+        # One batched tokenizer call per TOKENIZE_BATCH sentences instead of one per sentence
+        lengths = self._count_tokens([text[start:end] for start, end in zip(starts, ends)])
+        # The last sentence may still continue, so a chunk is only settled once a complete sentence overflows it
+        settled = len(starts) if final else len(starts) - 1
+        if max(lengths) > self.max_tokens:
+            split_starts, split_ends, split_lengths, split_paragraph_ends = [], [], [], []
+            for k, (start, end, length, paragraph_end) in enumerate(zip(starts, ends, lengths, paragraph_ends)):
+                if k == settled:
+                    settled = len(split_starts)
+                pieces = self._split_long(text, start, end) if length > self.max_tokens else [(start, end, length)]
+                for i, (piece_start, piece_end, piece_length) in enumerate(pieces):
+                    split_starts.append(piece_start)
+                    split_ends.append(piece_end)
+                    split_lengths.append(piece_length)
+                    split_paragraph_ends.append(paragraph_end and i == len(pieces) - 1)
+            starts, ends, lengths, paragraph_ends = split_starts, split_ends, split_lengths, split_paragraph_ends
+
+        # cumulative[k] is the number of tokens in the first k sentences
+        cumulative = np.concatenate([[0], np.cumsum(lengths)])
+        breaks = np.flatnonzero(paragraph_ends) + 1
+        count = len(starts)
+        spans = []
+        i = 0
+        while i < count:
+            # The most sentences from i that fit in the budget
+            fit = int(np.searchsorted(cumulative, cumulative[i] + self.max_tokens, side="right")) - 1
+            if not final and fit >= settled:
+                return spans, starts[i]
+            j = max(i + 1, fit)
+            last_break = np.searchsorted(breaks, j, side="right") - 1
+            if last_break >= 0 and breaks[last_break] > i:
+                paragraph = int(breaks[last_break])
+                if cumulative[paragraph] - cumulative[i] >= self.max_tokens // 2:
+                    j = paragraph
+            spans.append((starts[i], ends[j - 1]))
+            if j >= count:
+                break
+            # Start the next chunk at the earliest sentence whose tokens up to j fit in the overlap
+            i = max(i + 1, int(np.searchsorted(cumulative, cumulative[j] - self.overlap, side="left")))
+        return spans, len(text)
+
+
+def chunk_settings(name=CHUNKER):
+    """
+    Get the settings of the configured chunker, as recorded in the ingestion manifest.
+
+    Parameters:
+    name (str): One of CHUNKERS.
+
+    Returns:
+    Tuple[int, int, str]: The chunk length, overlap and chunker name.
+    """
+    if name == "tokens":
+        return CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, name
+    return CHUNK_LENGTH, CHUNK_OVERLAP, name
+
+
+def chunk_overlap_chars(name=CHUNKER):
+    """
+    Get the most characters two consecutive chunks of the configured chunker share.
+
+    Parameters:
+    name (str): One of CHUNKERS.
+
+    Returns:
+    int: The bound on the shared text, with a token's worth of slack.
+    """
+    if name == "tokens":
+        return (CHUNK_OVERLAP_TOKENS + 1) * _MAX_TOKEN_CHARS if CHUNK_OVERLAP_TOKENS else 0
+    return CHUNK_OVERLAP + _MAX_TOKEN_CHARS if CHUNK_OVERLAP else 0
+
+
+def get_chunker(model=None, name=CHUNKER):
+    """
+    Create the configured chunker.
+
+    Parameters:
+    model (SentenceTransformer): The model the chunks are embedded with; the token chunker uses its tokenizer and
+    max_seq_length.
+    name (str): One of CHUNKERS.
+
+    Returns:
+    Chunker: The chunker.
+    """
+    if name == "characters":
+        return CharacterChunker(CHUNK_LENGTH, CHUNK_OVERLAP)
+    if name != "tokens":
+        raise ValueError(f"Unknown chunker: {name}")
+    if model is None:
+        raise ValueError("The token chunker needs the embedding model")
+    # [CLS] and [SEP], or the model's equivalents, take two positions of the window
+    window = model.max_seq_length - 2
+    return TokenChunker(model.tokenizer, min(CHUNK_TOKENS, window) if CHUNK_TOKENS else window, CHUNK_OVERLAP_TOKENS)
@@ -0,0 +1,169 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from srv.chunkers import TOKENIZE_BATCH
+
+# Padded tokens per document encode batch. Chunks are sorted by token length, and a batch holds as many chunks of
+# similar length as fit in the budget, so batches of short chunks are larger and little compute goes to padding
+DOC_ENCODE_TOKEN_BUDGET = int(os.getenv("DOC_ENCODE_TOKEN_BUDGET", "32768"))
+DOC_ENCODE_MAX_BATCH = int(os.getenv("DOC_ENCODE_MAX_BATCH", "512"))
+# Intra-op threads torch uses while encoding on CPU; 0 keeps torch's default of one per core
+DOC_ENCODE_THREADS = int(os.getenv("DOC_ENCODE_THREADS", "0"))
+
+_threads_configured = False
+_threads_lock = threading.Lock()
+
+
+class EncodeStats:
+    """
+    Throughput counters for document encoding.
+    """
+
+    def __init__(self):
+        self.chunks = 0
+        self.batches = 0
+        self.tokens = 0
+        self.padded_tokens = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, chunks, tokens, padded_tokens, seconds):
+        """
+        Add one encode batch to the counters.
+
+        Parameters:
+        chunks (int): The number of chunks in the batch.
+        tokens (int): Their tokens, special tokens included.
+        padded_tokens (int): The tokens the batch was padded to, chunks times its longest chunk.
+        seconds (float): The time the model spent on the batch.
+
+        Returns:
+        None
+        """
+        with self._lock:
+            self.chunks += chunks
+            self.batches += 1
+            self.tokens += tokens
+            self.padded_tokens += padded_tokens
+            self.seconds += seconds
+
+    def stats(self):
+        """
+        Report document encoding throughput.
+
+        Parameters:
+        None
+
+        Returns:
+        Dict: The chunk, batch and token counts, the share of padded positions that held tokens,
+        the time spent encoding and the tokens and chunks encoded per second.
+        """
+        with self._lock:
+            return {
+                "chunks": self.chunks,
+                "batches": self.batches,
+                "tokens": self.tokens,
+                "padding_efficiency": self.tokens / self.padded_tokens if self.padded_tokens else 0.0,
+                "seconds": self.seconds,
+                "tokens_per_second": self.tokens / self.seconds if self.seconds else 0.0,
+                "chunks_per_second": self.chunks / self.seconds if self.seconds else 0.0,
+            }
+
+
+document_encode_stats = EncodeStats()
+
+
+def _configure_threads():
+    global _threads_configured
+    if not DOC_ENCODE_THREADS:
+        return
+    with _threads_lock:
+        if not _threads_configured:
+            import torch
+
+            torch.set_num_threads(DOC_ENCODE_THREADS)
+            _threads_configured = True
+
+
+def _token_lengths(model, chunks):
+    lengths = []
+    for i in range(0, len(chunks), TOKENIZE_BATCH):
+        encoded = model.tokenizer(
+            chunks[i : i + TOKENIZE_BATCH],
+            truncation=True,
+            max_length=model.max_seq_length,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )
+        lengths.extend(len(ids) for ids in encoded["input_ids"])
+    return np.asarray(lengths, dtype=np.int64)
+
+
+def length_buckets(lengths, token_budget=DOC_ENCODE_TOKEN_BUDGET, max_batch=DOC_ENCODE_MAX_BATCH):
+    """
+    Group chunks into batches of similar token length whose padded size fits a token budget.
+
+    Parameters:
+    lengths (np.array): The token length of each chunk.
+    token_budget (int): The most padded tokens per batch; a single chunk longer than it gets a batch of its own.
+    max_batch (int): The most chunks per batch.
+
+    Returns:
+    List[np.array]: The chunk indices of each batch, longest chunks first.
+    """
+    # Longest first, so a batch that does not fit in memory fails at the start of a long ingest
+    order = np.argsort(-lengths, kind="stable")
+    batches = []
+    start = 0
+    while start < len(order):
+        size = max(1, min(max_batch, token_budget // max(1, int(lengths[order[start]]))))
+        batches.append(order[start : start + size])
+        start += size
+    return batches
+
+
+def encode_documents(model, chunks, token_budget=DOC_ENCODE_TOKEN_BUDGET, max_batch=DOC_ENCODE_MAX_BATCH):
+    """
+    Embed document chunks in length-bucketed batches sized by token budget rather than chunk count,
+    and return the embeddings in the original order.
+
+    Parameters:
+    model (SentenceTransformer): The model to embed with.
+    chunks (List[str]): The chunks to embed.
+    token_budget (int): The most padded tokens per batch.
+    max_batch (int): The most chunks per batch.
+
+    Returns:
+    np.array: One embedding per chunk, in order.
+    """
+    _configure_threads()
+    embeddings = np.empty((len(chunks), model.get_sentence_embedding_dimension()), dtype=np.float32)
+    if not chunks:
+        return embeddings
+    lengths = _token_lengths(model, chunks)
+    for batch in length_buckets(lengths, token_budget, max_batch):
+        started = time.perf_counter()
+        embeddings[batch] = model.encode(
+            [chunks[i] for i in batch], batch_size=len(batch), convert_to_numpy=True, show_progress_bar=False
+        )
+        batch_lengths = lengths[batch]
+        document_encode_stats.record(
+            len(batch), int(batch_lengths.sum()), len(batch) * int(batch_lengths.max()), time.perf_counter() - started
+        )
+    return embeddings
+
+
+def document_encoder(model):
+    """
+    Bind encode_documents to a model, for use as the encode function of ChunkEmbeddingStore.embed.
+
+    Parameters:
+    model (SentenceTransformer): The model to embed with.
+
+    Returns:
+    Callable[[List[str]], np.array]: The encode function.
+    """
+    return lambda chunks: encode_documents(model, chunks)
@@ -1,189 +1,813 @@
+import itertools
 import os
+import threading
+import time
 
-import pandas as pd
-from sentence_transformers import SentenceTransformer
-
+from db.db_methods import HNSW_EF_CONSTRUCTION
+from db.db_methods import HNSW_M
+from db.db_methods import INDEX_TYPE
+from db.db_methods import IVFFLAT_LISTS
 from db.db_methods import check_db_size
-from db.db_methods import clear_books
-from db.db_methods import clear_embeddings
 from db.db_methods import create_index
-from db.db_methods import drop_book_embeddings
-from db.db_methods import drop_books_table
-from db.db_methods import fast_pg_insert
-from db.db_methods import get_book_text_by_title
+from db.db_methods import forget_index_options
 from db.db_methods import init_books_table
+from db.db_methods import initialize_book_centroids_table
 from db.db_methods import initialize_book_embeddings_table
-from db.db_methods import insert_book
-from db.db_methods import query_similar_books
-from db.db_methods import query_similar_chunks
-from db.db_methods import remove_index
+from db.db_methods import initialize_chunk_store_table
+from db.db_methods import initialize_corpus_state_table
+from db.embedding_matrix import EMBEDDING_MATRIX_PATH
+from db.embedding_matrix import export_embedding_matrix
+from db.embedding_matrix import get_embedding_matrix
+from db.index_build import rebuild_index
+from db.vector_store import VECTOR_BACKEND
+from db.vector_store import get_vector_store
+from srv.batcher import MicroBatcher
+from srv.chunk_store import ChunkEmbeddingStore
+from srv.chunkers import CHUNK_LENGTH
+from srv.chunkers import chunk_overlap_chars
+from srv.chunkers import get_chunker
+from srv.document_encoder import document_encode_stats
+from srv.document_encoder import document_encoder
+from srv.embedding_cache import EmbeddingCache
+from srv.embedding_cache import normalize_query
+from srv.model_registry import use_model
+from srv.model_registry import warm_models
+from srv.result_cache import ResultCache
 
 # Get the model name from the environment variable
 MODEL_NAME = os.getenv("MODEL_NAME", "all-MiniLM-L6-v2")
-CHUNK_LENGTH = int(os.getenv("CHUNK_LENGTH", "500"))
-CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
+# Characters read, chunked, encoded and inserted at a time by the streaming ingest mode
+STREAM_WINDOW_SIZE = int(os.getenv("STREAM_WINDOW_SIZE", "1000000"))
+# Reuse embeddings of chunks already embedded by this model, in any book, instead of encoding them again
+CHUNK_STORE = os.getenv("CHUNK_STORE", "true").lower() in ("1", "true", "yes")
+# Concurrent query embeddings are grouped into one encode call of up to ENCODER_MAX_BATCH queries,
+# waiting at most ENCODER_MAX_WAIT_MS for a batch to fill
+ENCODER_BATCHING = os.getenv("ENCODER_BATCHING", "true").lower() in ("1", "true", "yes")
+ENCODER_MAX_BATCH = int(os.getenv("ENCODER_MAX_BATCH", "32"))
+ENCODER_MAX_WAIT_MS = float(os.getenv("ENCODER_MAX_WAIT_MS", "3"))
+# Query embeddings are cached per model; QUERY_CACHE_PATH adds a SQLite tier shared by all workers on the host
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "10000"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH") or None
+# Ranked results are cached until the corpus generation changes; the generation is re-read from the database at most
+# every CORPUS_GENERATION_TTL seconds so ingests from other processes are picked up
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1000"))
+CORPUS_GENERATION_TTL = float(os.getenv("CORPUS_GENERATION_TTL", "1"))
+# Context windows of extended results recently returned, kept until the corpus generation changes
+CONTEXT_CACHE_SIZE = int(os.getenv("CONTEXT_CACHE_SIZE", "10000"))
+
+_query_batcher = None
+_query_batcher_lock = threading.Lock()
+query_cache = EmbeddingCache(MODEL_NAME, QUERY_CACHE_SIZE, QUERY_CACHE_TTL, QUERY_CACHE_PATH)
+result_cache = ResultCache(RESULT_CACHE_SIZE)
+context_cache = ResultCache(CONTEXT_CACHE_SIZE)
+# The chunk store lives in PostgreSQL, so other backends only dedup chunks within each call
+chunk_store = ChunkEmbeddingStore(MODEL_NAME, CHUNK_STORE and VECTOR_BACKEND == "pgvector")
+_corpus_generation = None
+_corpus_generation_checked = 0.0
+
+
+def _current_corpus_generation():
+    """
+    Get the corpus generation, re-reading it from the database once CORPUS_GENERATION_TTL has passed.
 
+    Parameters:
+    None
 
-def _chunk_text(text, n=500, overlap=50):
+    Returns:
+    int: The corpus generation.
     """
-    Split a text into overlapping chunks of length n.
+    global _corpus_generation, _corpus_generation_checked
+    now = time.monotonic()
+    if _corpus_generation is None or now - _corpus_generation_checked >= CORPUS_GENERATION_TTL:
+        generation = get_vector_store().get_corpus_generation()
+        if generation != _corpus_generation:
+            # Another process may have rebuilt the index with a different number of IVFFlat lists
+            forget_index_options()
+        _corpus_generation = generation
+        _corpus_generation_checked = now
+    return _corpus_generation
+
+
+def mark_corpus_changed():
+    """
+    Record that the corpus changed so every cached search result is invalidated, here and in other processes.
 
     Parameters:
-    text (str): The text to split into chunks.
-    n (int): The length of each chunk.
-    overlap (int): The number of characters to overlap between chunks.
+    None
 
     Returns:
-    List[str]: A list of overlapping text chunks.
+    None
     """
-    return [text[i : i + n] for i in range(0, len(text), n - overlap)]
+    global _corpus_generation, _corpus_generation_checked
+    _corpus_generation = get_vector_store().bump_corpus_generation()
+    _corpus_generation_checked = time.monotonic()
+    forget_index_options()
+    result_cache.clear()
+    context_cache.clear()
 
 
-def _process_doc(file_path):
+def chunk_document(text, model=None):
     """
-    Process a document by loading it from disk, splitting it into chunks, and processing each chunk.
+    Split a document's text into chunks with the configured chunker and collapse the whitespace in each.
 
     Parameters:
-    file_path (str): The path to the file to process.
+    text (str): The text of the document.
+    model (SentenceTransformer): The model the chunks will be embedded with, whose tokenizer the token chunker uses.
 
     Returns:
-    List[str]: A list of processed text chunks.
+    Tuple[List[str], List[int]]: The processed text chunks and the exact offset of each in the text.
     """
-
-    text = ""
-    with open(file_path, "r", encoding="utf-8") as f:
-        text = f.read()
-    chunks = _chunk_text(text, CHUNK_LENGTH, CHUNK_OVERLAP)
-    chunks = [" ".join(chunk.split()) for chunk in chunks]
-    return chunks
+    return get_chunker(model).chunk(text)
 
 
-def _embed_doc(file_path, model, verbose=False):
+def _embed_doc(text, model, verbose=False):
     """
-    Embed a document by loading it from disk, splitting it into chunks, and embedding each chunk.
+    Embed a document by splitting its text into chunks and embedding each chunk.
 
     Parameters:
-    file_path (str): The path to the file to embed.
+    text (str): The text of the document.
     model (SentenceTransformer): The sentence transformer model to use for embedding.
 
     Returns:
-    Tuple[List[str], List[np.array]]: A tuple containing a list of text chunks and a list of chunk embeddings.
+    Tuple[List[str], List[int], List[np.array]]: The text chunks, their offsets in the text and their embeddings.
     """
+    chunks, chunk_offsets = chunk_document(text, model)
     if verbose:
-        print(f"Embedding {file_path}...")
-    chunks = _process_doc(file_path)
-    return chunks, model.encode(chunks)
+        print(f"Embedding {len(chunks)} chunks...")
+    return chunks, chunk_offsets, chunk_store.embed(chunks, document_encoder(model))
 
 
-def _prepare_doc_for_db(file_path, model, verbose=False):
+def insert_chunks(title, chunks, embeddings, chunk_offsets, first_chunk_number=1):
     """
-    Prepare a document for database insertion by embedding it and creating a DataFrame.
+    Insert the embedded chunks of one document, or one window of it, into the vector store.
 
     Parameters:
-    file_path (str): The path to the file to process.
-    model (SentenceTransformer): The sentence transformer model to use for embedding.
+    title (str): The title of the book.
+    chunks (List[str]): The text chunks of the book.
+    embeddings (np.array): One embedding per chunk.
+    chunk_offsets (List[int]): The offset of each chunk in the book text.
+    first_chunk_number (int): The chunk number of the first chunk.
+
+    Returns:
+    None
+    """
+    chunk_numbers = range(first_chunk_number, first_chunk_number + len(chunks))
+    get_vector_store().insert_chunks(title, chunks, chunk_numbers, chunk_offsets, embeddings)
+
+
+def document_title(path):
+    """
+    Get the title a document is stored under: its file name, with .txt in place of an .epub or .pdf extension.
+
+    Parameters:
+    path (str): The path to the document.
 
     Returns:
-    pd.DataFrame: A DataFrame containing the embeddings and associated metadata.
+    str: The title of the document.
     """
-    chunks, embeddings = _embed_doc(file_path, model, verbose)
-    title = os.path.basename(file_path)
+    name = os.path.basename(path)
+    if name.endswith((".epub", ".pdf")):
+        return os.path.splitext(name)[0] + ".txt"
+    return name
+
+
+def iter_text_file(file_path, window_size=STREAM_WINDOW_SIZE):
+    """
+    Read a text file in blocks of window_size characters.
+
+    Parameters:
+    file_path (str): The path to the file.
+    window_size (int): The number of characters to read at a time.
 
-    chunk_offsets = []
-    curr_offset = 0
-    for chunk in chunks:
-        chunk_offsets.append(curr_offset)
-        curr_offset += len(chunk) + 1 - CHUNK_OVERLAP
+    Yields:
+    str: The next block of the file.
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        yield from iter(lambda: f.read(window_size), "")
 
-    embeddings_list = [embedding.tolist() for embedding in embeddings]
 
-    data = {
-        "book_title": [title] * len(chunks),
-        "chunk_text": chunks,
-        "chunk_number": [int(x) for x in range(1, len(chunks) + 1)],
-        "begin_offset": chunk_offsets,
-        "embedding": embeddings_list,
-    }
-    return pd.DataFrame(data)
+def _coalesce(blocks, window_size):
+    # Small blocks, such as PDF pages, are gathered so each window is embedded in one reasonably large batch
+    pending = []
+    pending_length = 0
+    for block in blocks:
+        pending.append(block)
+        pending_length += len(block)
+        if pending_length >= window_size:
+            yield "".join(pending)
+            pending = []
+            pending_length = 0
+    if pending:
+        yield "".join(pending)
 
 
-def insert_doc_to_db(
-    file_path,
-    columns=["book_title", "chunk_text", "chunk_number", "begin_offset", "embedding"],
-    verbose=False,
-):
+def _iter_chunk_windows(blocks, chunker):
     """
-    Process a document, prepare it for database insertion, and insert it into the database.
+    Split text arriving block by block into the same chunks the chunker makes of the whole text,
+    keeping only the text from the first chunk that more text could still change onwards in memory.
 
     Parameters:
-    file_path (str): The path to the file to process.
-    model (SentenceTransformer): The sentence transformer model to use for embedding.
-    columns (List[str]): A list of column names in the target table that correspond to the DataFrame columns.
+    blocks (Iterable[str]): The text, in consecutive blocks.
+    chunker (Chunker): The chunker.
+
+    Yields:
+    Tuple[str, List[Tuple[int, str]]]: Each block and the (offset, whitespace-collapsed chunk) pairs it completed,
+    then an empty block with the chunks left at the end of the text.
+    """
+    buffer = ""
+    buffer_start = 0
+    for block in itertools.chain(blocks, [None]):
+        at_end = block is None
+        block = block or ""
+        buffer += block
+        spans, carry = chunker.partial_spans(buffer, final=at_end)
+        window = [(buffer_start + start, " ".join(buffer[start:end].split())) for start, end in spans]
+        buffer = buffer[carry:]
+        buffer_start += carry
+        yield block, window
+
+
+def _insert_text_streaming(title, blocks, verbose=False):
+    """
+    Insert a document window by window so memory use does not grow with the size of the book.
+    Chunk offsets are the exact positions of each chunk in the raw text.
+
+    Parameters:
+    title (str): The title of the book.
+    blocks (Iterable[str]): The text of the book, in consecutive blocks.
 
     Returns:
     None
     """
+    # An existing book keeps its text, matching insert_book's ON CONFLICT DO NOTHING
+    vector_store = get_vector_store()
+    new_book = vector_store.insert_book(title, "")
+    chunk_number = 1
+    part_number = 1
+    try:
+        with use_model(MODEL_NAME) as model:
+            chunker = get_chunker(model)
+            encode = document_encoder(model)
+            for block, window in _iter_chunk_windows(_coalesce(blocks, STREAM_WINDOW_SIZE), chunker):
+                if block and new_book:
+                    # Each window is stored as its own part; the text is assembled once, after the last one
+                    vector_store.add_book_text_part(title, part_number, block)
+                    part_number += 1
+                if not window:
+                    continue
+                offsets = [offset for offset, _ in window]
+                chunks = [chunk for _, chunk in window]
+                if verbose:
+                    print(f"Embedding chunks {chunk_number} to {chunk_number + len(chunks) - 1}...")
+                insert_chunks(title, chunks, chunk_store.embed(chunks, encode), offsets, chunk_number)
+                chunk_number += len(chunks)
+        if new_book:
+            vector_store.assemble_book_text(title)
+    except BaseException:
+        # Remove a half-ingested new book rather than leave it searchable with part of its chunks
+        if new_book:
+            vector_store.delete_book(title)
+        raise
+    vector_store.refresh_book(title)
+
+
+def _print_ingest_stats():
+    stats = document_encoder_stats()
+    print(f"Chunk dedup ratio: {chunk_store.stats()['dedup_ratio']:.1%}")
+    print(
+        f"Encoded {stats['tokens']} tokens in {stats['batches']} batches, {stats['tokens_per_second']:.0f} tokens/s, "
+        f"padding efficiency {stats['padding_efficiency']:.1%}"
+    )
+
+
+def insert_text_to_db(title, text, verbose=False, stream=False):
+    """
+    Chunk, embed and insert a document that is already in memory, or arrives as a stream of text blocks.
+
+    Parameters:
+    title (str): The title of the book.
+    text (Union[str, Iterable[str]]): The text of the book, or its consecutive blocks when streaming.
+    verbose (bool): Whether to print progress.
+    stream (bool): Whether to embed and insert the document in windows of STREAM_WINDOW_SIZE characters
+    as its blocks arrive.
+
+    Returns:
+    None
+    """
+    if stream:
+        _insert_text_streaming(title, [text] if isinstance(text, str) else text, verbose)
+        mark_corpus_changed()
+        if verbose:
+            _print_ingest_stats()
+        return
+    if not isinstance(text, str):
+        text = "".join(text)
     if verbose:
         print("Loading model...")
-    model = SentenceTransformer(MODEL_NAME)
-    if verbose:
-        print("Begining insertion process...")
-    df = _prepare_doc_for_db(file_path, model, verbose)
+    with use_model(MODEL_NAME) as model:
+        if verbose:
+            print("Begining insertion process...")
+        chunks, chunk_offsets, embeddings = _embed_doc(text, model, verbose)
     if verbose:
         print("Inserting chunks...")
-    title = os.path.basename(file_path)
+    store_document(title, text, chunks, embeddings, chunk_offsets)
+    mark_corpus_changed()
+    if verbose:
+        _print_ingest_stats()
+
+
+def insert_doc_to_db(file_path, verbose=False, stream=False):
+    """
+    Process a text file, prepare it for database insertion, and insert it into the database.
+    The file is read once; when streaming it is read in windows of STREAM_WINDOW_SIZE characters.
+
+    Parameters:
+    file_path (str): The path to the file to process.
+    verbose (bool): Whether to print progress.
+    stream (bool): Whether to read, embed and insert the document in windows of STREAM_WINDOW_SIZE characters.
+
+    Returns:
+    None
+    """
+    if stream:
+        insert_text_to_db(document_title(file_path), iter_text_file(file_path), verbose, stream=True)
+        return
     with open(file_path, "r", encoding="utf-8") as f:
         text = f.read()
-    insert_book(title, text)
-    fast_pg_insert(df, columns)
+    insert_text_to_db(document_title(file_path), text, verbose)
 
 
-def query_database(query, n=5, verbose=False, books=False, extended=False):
+def store_document(title, text, chunks, embeddings, chunk_offsets):
+    """
+    Insert a book's text and its embedded chunks into the database and refresh its centroid.
+    Callers are responsible for calling mark_corpus_changed once they are done inserting.
+
+    Parameters:
+    title (str): The title of the book.
+    text (str): The full text of the book.
+    chunks (List[str]): The text chunks of the book.
+    embeddings (np.array): One embedding per chunk.
+    chunk_offsets (List[int]): The offset of each chunk in the text.
+
+    Returns:
+    None
+    """
+    get_vector_store().insert_book(title, text)
+    insert_chunks(title, chunks, embeddings, chunk_offsets)
+    get_vector_store().refresh_book(title)
+
+
+def replace_document(title, text, chunks, embeddings, chunk_offsets):
+    """
+    Insert a book's text and its embedded chunks into the database, replacing any chunks already stored for it,
+    and refresh its centroid, all in one transaction. Callers are responsible for calling mark_corpus_changed once they
+    are done inserting.
+
+    Parameters:
+    title (str): The title of the book.
+    text (str): The full text of the book.
+    chunks (List[str]): The text chunks of the book.
+    embeddings (np.array): One embedding per chunk.
+    chunk_offsets (List[int]): The offset of each chunk in the text.
+
+    Returns:
+    None
+    """
+    chunk_numbers = range(1, len(chunks) + 1)
+    get_vector_store().replace_document(title, text, chunks, chunk_numbers, chunk_offsets, embeddings)
+
+
+def _encode_queries(queries, batch_size=None):
+    """
+    Embed a batch of query strings with the configured model.
+
+    Parameters:
+    queries (List[str]): The texts to embed.
+
+    Returns:
+    List[List[float]]: One embedding per query.
+    """
+    with use_model(MODEL_NAME) as model:
+        return model.encode(queries, batch_size=batch_size or len(queries)).tolist()
+
+
+def get_query_batcher():
+    """
+    Get the process-wide micro-batcher in front of the query encoder, starting it on first use.
+
+    Parameters:
+    None
+
+    Returns:
+    MicroBatcher: The shared query batcher.
+    """
+    global _query_batcher
+    with _query_batcher_lock:
+        if _query_batcher is None:
+            _query_batcher = MicroBatcher(_encode_queries, ENCODER_MAX_BATCH, ENCODER_MAX_WAIT_MS / 1000, name="query-encoder")
+        return _query_batcher
+
+
+def embed_query(query):
+    """
+    Embed a query string with the configured model, reusing a cached embedding when there is one.
+    When ENCODER_BATCHING is enabled the query is encoded together with any other queries arriving at the same time.
+
+    Parameters:
+    query (str): The text to embed.
+
+    Returns:
+    List[float]: The query embedding.
+    """
+    embedding = query_cache.get(MODEL_NAME, query)
+    if embedding is not None:
+        return embedding
+    if ENCODER_BATCHING:
+        embedding = get_query_batcher()(query)
+    else:
+        embedding = _encode_queries([query])[0]
+    query_cache.put(MODEL_NAME, query, embedding)
+    return embedding
+
+
+def embed_queries(queries):
+    """
+    Embed many query strings, encoding every query that is not cached in one batched model.encode call.
+
+    Parameters:
+    queries (List[str]): The texts to embed.
+
+    Returns:
+    List[List[float]]: One embedding per query, in order.
+    """
+    embeddings = [query_cache.get(MODEL_NAME, query) for query in queries]
+    missing = list(dict.fromkeys(query for query, embedding in zip(queries, embeddings) if embedding is None))
+    if missing:
+        encoded = dict(zip(missing, _encode_queries(missing, ENCODER_MAX_BATCH)))
+        for query, embedding in encoded.items():
+            query_cache.put(MODEL_NAME, query, embedding)
+        embeddings = [encoded[query] if embedding is None else embedding for query, embedding in zip(queries, embeddings)]
+    return embeddings
+
+
+def encoder_stats():
+    """
+    Report batch fill metrics for the query encoder.
+
+    Parameters:
+    None
+
+    Returns:
+    Dict: The micro-batcher statistics, or an empty dictionary if batching is disabled or unused.
+    """
+    if _query_batcher is None:
+        return {}
+    return _query_batcher.stats()
+
+
+def _query_chunks(query_embedding, n, ef_search=None, probes=None):
+    """
+    Find the chunks closest to a query embedding, with exact search over the exported embedding matrix
+    when it is enabled and was exported from the current corpus, and through the vector store otherwise.
+    """
+    matrix = get_embedding_matrix()
+    if matrix is not None and matrix.generation == _current_corpus_generation():
+        return matrix.query(query_embedding, n)
+    return get_vector_store().query_chunks(query_embedding, n, ef_search, probes)
+
+
+def search_by_embedding(query_embedding, n=5, books=False, extended=False, ef_search=None, probes=None):
+    """
+    Query the database for the chunks or books closest to an already computed query embedding.
+
+    Parameters:
+    query_embedding (List[float]): The embedding to search for.
+    n (int): The number of results to return.
+    books (bool): Whether to search whole books instead of text chunks.
+    extended (bool): Whether to return the text surrounding each matching chunk.
+    ef_search (int): The HNSW candidate list size, or None for the default; higher is slower but more accurate.
+    probes (int): The number of IVFFlat lists to scan, or None for the default.
+
+    Returns:
+    List[Dict]: A list of dictionaries with the title, text and similarity of each result.
+    """
+    return format_results(find_similar(query_embedding, n, books, ef_search, probes), books, extended)
+
+
+def find_similar(query_embedding, n=5, books=False, ef_search=None, probes=None):
+    """
+    Run the nearest-neighbour lookup of a search and return its raw rows, without reading any book text.
+
+    Parameters:
+    query_embedding (List[float]): The embedding to search for.
+    n (int): The number of results to return.
+    books (bool): Whether to search whole books instead of text chunks.
+    ef_search (int): The HNSW candidate list size, or None for the default.
+    probes (int): The number of IVFFlat lists to scan, or None for the default.
+
+    Returns:
+    List[Tuple]: (book_title, centroid, distance) rows for books, (book_title, chunk_text, distance, begin_offset)
+    rows for chunks, closest first.
+    """
+    if books:
+        return get_vector_store().query_books(query_embedding, n, ef_search)
+    return _query_chunks(query_embedding, n, ef_search, probes)
+
+
+def search_by_embeddings(query_embeddings, n=5, books=False, extended=False, ef_search=None, probes=None):
+    """
+    Query the database for the chunks or books closest to each of several query embeddings in one round trip.
+
+    Parameters:
+    query_embeddings (List[List[float]]): The embeddings to search for.
+    n (int): The number of results to return per query.
+    books (bool): Whether to search whole books instead of text chunks.
+    extended (bool): Whether to return the text surrounding each matching chunk.
+    ef_search (int): The HNSW candidate list size, or None for the default.
+    probes (int): The number of IVFFlat lists to scan, or None for the default.
+
+    Returns:
+    List[List[Dict]]: The results of each query, as returned by search_by_embedding.
+    """
+    if books:
+        results = get_vector_store().query_books_batch(query_embeddings, n, ef_search)
+    else:
+        matrix = get_embedding_matrix()
+        if matrix is not None and matrix.generation == _current_corpus_generation():
+            results = matrix.query_batch(query_embeddings, n)
+        else:
+            results = get_vector_store().query_chunks_batch(query_embeddings, n, ef_search, probes)
+    # Context windows of every query are fetched together
+    flat = format_results([row for query_results in results for row in query_results], books, extended)
+    formatted = []
+    for query_results in results:
+        formatted.append(flat[: len(query_results)])
+        flat = flat[len(query_results) :]
+    return formatted
+
+
+def _context_windows(rows):
+    """
+    Get the text within CHUNK_LENGTH characters of each chunk row, from the context cache where possible and
+    otherwise from the vector store in one call, so only the windows are read however long the books are.
+
+    Parameters:
+    rows (List[Tuple]): Chunk rows returned by find_similar.
+
+    Returns:
+    List[str]: The context of each row, in order.
+    """
+    generation = _current_corpus_generation()
+    keys = [(row[0], max(0, row[3] - CHUNK_LENGTH), row[3] + CHUNK_LENGTH) for row in rows]
+    windows = [context_cache.get(key, generation) for key in keys]
+    missing = list(dict.fromkeys(key for key, window in zip(keys, windows) if window is None))
+    if missing:
+        fetched = dict(zip(missing, get_vector_store().get_text_windows(missing, chunk_overlap_chars())))
+        for key, window in fetched.items():
+            context_cache.put(key, generation, window)
+        windows = [fetched[key] if window is None else window for key, window in zip(keys, windows)]
+    return windows
+
+
+def format_results(results, books=False, extended=False):
+    """
+    Turn rows returned by find_similar into result dictionaries, fetching the context of all extended rows at once.
+
+    Parameters:
+    results (List[Tuple]): The rows.
+    books (bool): Whether the rows are books rather than chunks.
+    extended (bool): Whether to return the text surrounding each chunk instead of the chunk itself.
+
+    Returns:
+    List[Dict]: The title, text and similarity of each result.
+    """
+    if books:
+        return [{"title": result[0], "text": "N/A", "similarity": result[2]} for result in results]
+    if not extended:
+        return [{"title": result[0], "text": result[1], "similarity": result[2]} for result in results]
+    return [
+        {"title": result[0], "text": window, "similarity": result[2]}
+        for result, window in zip(results, _context_windows(results))
+    ]
+
+
+def format_result(result, books=False, extended=False):
+    """
+    Turn one row returned by find_similar into a result dictionary, reading the text around the chunk when extended.
+
+    Parameters:
+    result (Tuple): The row.
+    books (bool): Whether the row is a book rather than a chunk.
+    extended (bool): Whether to return the text surrounding the chunk instead of the chunk itself.
+
+    Returns:
+    Dict: The title, text and similarity of the result.
+    """
+    return format_results([result], books, extended)[0]
+
+
+def _result_cache_key(query, n, books, extended, ef_search, probes):
+    return (MODEL_NAME, normalize_query(query), n, books, extended, ef_search, probes)
+
+
+def get_cached_results(query, n=5, books=False, extended=False, ef_search=None, probes=None):
+    """
+    Look up the cached results of a search against the current corpus.
+
+    Parameters:
+    query (str): The text to search for in the database.
+    n (int): The number of results to return.
+    books (bool): Whether to search whole books instead of text chunks.
+    extended (bool): Whether to return the text surrounding each matching chunk.
+    ef_search (int): The HNSW candidate list size, or None for the default.
+    probes (int): The number of IVFFlat lists to scan, or None for the default.
+
+    Returns:
+    Tuple[List[Dict], int]: The cached results, or None on a miss, and the corpus generation to cache fresh results under.
+    """
+    generation = _current_corpus_generation()
+    return result_cache.get(_result_cache_key(query, n, books, extended, ef_search, probes), generation), generation
+
+
+def get_cached_results_batch(queries, n=5, books=False, extended=False, ef_search=None, probes=None):
+    """
+    Look up the cached results of several searches against the current corpus.
+
+    Parameters:
+    queries (List[str]): The texts to search for in the database.
+    n (int): The number of results to return per query.
+    books (bool): Whether to search whole books instead of text chunks.
+    extended (bool): Whether to return the text surrounding each matching chunk.
+    ef_search (int): The HNSW candidate list size, or None for the default.
+    probes (int): The number of IVFFlat lists to scan, or None for the default.
+
+    Returns:
+    Tuple[List[List[Dict]], int]: The cached results of each query, None on a miss, and the corpus generation.
+    """
+    generation = _current_corpus_generation()
+    keys = [_result_cache_key(query, n, books, extended, ef_search, probes) for query in queries]
+    return [result_cache.get(key, generation) for key in keys], generation
+
+
+def cache_results(query, n, books, extended, generation, results, ef_search=None, probes=None):
+    """
+    Cache the results of a search.
+
+    Parameters:
+    query (str): The text that was searched for.
+    n (int): The number of results requested.
+    books (bool): Whether whole books were searched.
+    extended (bool): Whether extended context was returned.
+    generation (int): The corpus generation read before the search ran.
+    results (List[Dict]): The search results.
+    ef_search (int): The HNSW candidate list size the search ran with.
+    probes (int): The number of IVFFlat lists the search scanned.
+
+    Returns:
+    None
+    """
+    result_cache.put(_result_cache_key(query, n, books, extended, ef_search, probes), generation, results)
+
+
+def query_database(query, n=5, verbose=False, books=False, extended=False, ef_search=None, probes=None):
     """
     Query the database for documents containing the given text.
 
     Parameters:
     query (str): The text to search for in the database.
+    ef_search (int): The HNSW candidate list size, or None for the default; higher is slower but more accurate.
+    probes (int): The number of IVFFlat lists to scan, or None for the default.
 
     Returns:
     List[Tuple[str, str]]: A list of tuples containing the document title and the matching text.
     """
-    if verbose:
-        print("Loading model...")
-    model = SentenceTransformer(MODEL_NAME)
+    results, generation = get_cached_results(query, n, books, extended, ef_search, probes)
+    if results is not None:
+        if verbose:
+            print("Using cached results...")
+        return results
     if verbose:
         print("Embedding query...")
-    query_embedding = model.encode([query])[0].tolist()
+    query_embedding = embed_query(query)
     if verbose:
         print("Querying database...")
-    if books:
-        results = query_similar_books(query_embedding, n)
-        results_dict = [{"title": result[0], "text": "N/A", "similarity": result[2]} for result in results]
-    elif extended:
-        chunk_results = query_similar_chunks(query_embedding, n)
-        results_dict = []
-        curr_title = ""
-        for result in chunk_results:
-            if result[0] != curr_title:
-                curr_title = result[0]
-            book_text = get_book_text_by_title(curr_title)
-            offset = result[3]
-
-            start = max(0, offset - CHUNK_LENGTH)
-            end = min(len(book_text), offset + CHUNK_LENGTH)
-
-            results_dict.append(
-                {
-                    "title": result[0],
-                    "text": book_text[start:end],
-                    "similarity": result[2],
-                }
-            )
-    else:
-        results = query_similar_chunks(query_embedding, n)
-        results_dict = [{"title": result[0], "text": result[1], "similarity": result[2]} for result in results]
+    results = search_by_embedding(query_embedding, n, books, extended, ef_search, probes)
+    cache_results(query, n, books, extended, generation, results, ef_search, probes)
+    return results
+
+
+def query_database_batch(queries, n=5, verbose=False, books=False, extended=False, ef_search=None, probes=None):
+    """
+    Query the database for many texts at once: cached results are reused, the remaining queries are embedded in one
+    batch and looked up in one round trip.
+
+    Parameters:
+    queries (List[str]): The texts to search for in the database.
+    n (int): The number of results to return per query.
+    verbose (bool): Whether to print progress.
+    books (bool): Whether to search whole books instead of text chunks.
+    extended (bool): Whether to return the text surrounding each matching chunk.
+    ef_search (int): The HNSW candidate list size, or None for the default.
+    probes (int): The number of IVFFlat lists to scan, or None for the default.
+
+    Returns:
+    List[List[Dict]]: The results of each query, in order.
+    """
+    results, generation = get_cached_results_batch(queries, n, books, extended, ef_search, probes)
+    misses = [i for i, cached in enumerate(results) if cached is None]
+    if verbose:
+        print(f"{len(queries) - len(misses)} of {len(queries)} queries cached")
+    if not misses:
+        return results
+    if verbose:
+        print(f"Embedding {len(misses)} queries...")
+    embeddings = embed_queries([queries[i] for i in misses])
+    if verbose:
+        print("Querying database...")
+    found = search_by_embeddings(embeddings, n, books, extended, ef_search, probes)
+    for i, query_results in zip(misses, found):
+        results[i] = query_results
+        cache_results(queries[i], n, books, extended, generation, query_results, ef_search, probes)
+    return results
+
+
+def query_cache_stats():
+    """
+    Report hit and miss counts for the query embedding cache.
+
+    Parameters:
+    None
+
+    Returns:
+    Dict: The query embedding cache statistics.
+    """
+    return query_cache.stats()
+
+
+def chunk_store_stats():
+    """
+    Report how many chunk encodings the content-addressed chunk store saved.
+
+    Parameters:
+    None
+
+    Returns:
+    Dict: The chunk store statistics, including the dedup ratio.
+    """
+    return chunk_store.stats()
+
+
+def result_cache_stats():
+    """
+    Report hit, miss and invalidation counts for the search result cache.
+
+    Parameters:
+    None
+
+    Returns:
+    Dict: The search result cache statistics.
+    """
+    return result_cache.stats()
+
+
+def context_cache_stats():
+    """
+    Report hit, miss and invalidation counts for the context window cache of extended results.
+
+    Parameters:
+    None
 
-    return results_dict
+    Returns:
+    Dict: The context window cache statistics.
+    """
+    return context_cache.stats()
+
+
+def document_encoder_stats():
+    """
+    Report token throughput and padding efficiency of document encoding since startup.
+
+    Parameters:
+    None
+
+    Returns:
+    Dict: The document encoder statistics.
+    """
+    return document_encode_stats.stats()
+
+
+def warm_model():
+    """
+    Load the configured model into the process-wide registry so the first query does not pay for it.
+
+    Parameters:
+    None
+
+    Returns:
+    None
+    """
+    warm_models([MODEL_NAME])
 
 
 def init_table():
@@ -199,43 +823,61 @@ def init_table():
     print("Creating tables...")
     init_books_table()
     initialize_book_embeddings_table()
+    initialize_book_centroids_table()
+    initialize_chunk_store_table()
+    initialize_corpus_state_table()
     print("Tables created.")
 
 
-def init_index():
+def _describe_index(parameters):
+    return f"{parameters.pop('type')} ({', '.join(f'{name}={value}' for name, value in parameters.items())})"
+
+
+def init_index(index_type=INDEX_TYPE, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, lists=IVFFLAT_LISTS):
     """
     Initialize the database index for the embeddings column.
 
     Parameters:
-    None
+    index_type (str): "hnsw" or "ivfflat".
+    m (int): The maximum number of connections per HNSW layer.
+    ef_construction (int): The candidate list size while building an HNSW index.
+    lists (int): The number of IVFFlat lists, or 0 to choose it from the number of chunks.
 
     Returns:
     None
     """
     print("Creating index...")
-    create_index()
-    print("Index created.")
+    parameters = create_index(index_type, m, ef_construction, lists)
+    # Bumping the generation makes other processes read the new index's options, such as its number of lists
+    mark_corpus_changed()
+    print(f"Index created: {_describe_index(parameters)}.")
 
 
-def reindex():
+def reindex(index_type=INDEX_TYPE, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, lists=IVFFLAT_LISTS):
     """
     Recreate the database index for the embeddings column.
+    The new index is built concurrently while the old one keeps serving searches, then replaces it.
+    Other processes pick up its default IVFFlat probes once they see the corpus generation change.
 
     Parameters:
-    None
+    index_type (str): "hnsw" or "ivfflat".
+    m (int): The maximum number of connections per HNSW layer.
+    ef_construction (int): The candidate list size while building an HNSW index.
+    lists (int): The number of IVFFlat lists, or 0 to choose it from the number of chunks.
 
     Returns:
     None
     """
     print("Recreating index...")
-    remove_index()
-    create_index()
-    print("Index recreated.")
+    parameters = rebuild_index(index_type, m, ef_construction, lists)
+    # Bumping the generation makes other processes read the new index's options, such as its number of lists
+    mark_corpus_changed()
+    print(f"Index recreated: {_describe_index(parameters)}.")
 
 
 def clear_db():
     """
-    Clear the PostgreSQL table of all data.
+    Clear the vector store of all data.
 
     Parameters:
     None
@@ -244,15 +886,14 @@ def clear_db():
     None
     """
     print("Clearing database...")
-    remove_index()
-    clear_embeddings()
-    clear_books()
+    get_vector_store().clear()
+    mark_corpus_changed()
     print("Database cleared.")
 
 
 def delete_table():
     """
-    Drop the PostgreSQL table for storing book embeddings.
+    Drop the storage of the vector store.
 
     Parameters:
     None
@@ -261,11 +902,26 @@ def delete_table():
     None
     """
     print("Dropping tables...")
-    drop_book_embeddings()
-    drop_books_table()
+    get_vector_store().drop()
+    mark_corpus_changed()
     print("Tables dropped.")
 
 
+def export_matrix():
+    """
+    Export every chunk embedding to the memory-mapped matrix at EMBEDDING_MATRIX_PATH for exact search.
+
+    Parameters:
+    None
+
+    Returns:
+    None
+    """
+    print("Exporting embeddings...")
+    count, generation = export_embedding_matrix(get_vector_store().iter_chunk_embeddings())
+    print(f"Exported {count} chunks at corpus generation {generation} to {EMBEDDING_MATRIX_PATH}.")
+
+
 def get_database_size():
     """
     Get the size of the database in a human-readable format.
@@ -277,4 +933,10 @@ def get_database_size():
     str: The size of the database.
     """
     print("Querying database size...")
+    storage = chunk_store.storage()
+    if storage:
+        print(
+            f"Chunk store: {storage['rows']} embeddings in {storage['store_bytes'] / 2**20:.1f} MB, "
+            f"{storage['overhead_ratio']:.1%} on top of the chunk table"
+        )
     return check_db_size()
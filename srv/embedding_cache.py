@@ -0,0 +1,231 @@
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+CREATE_CACHE_TABLE = """
+                    CREATE TABLE IF NOT EXISTS query_embeddings (
+                        model TEXT,
+                        query TEXT,
+                        embedding BLOB,
+                        created REAL,
+                        PRIMARY KEY (model, query)
+                    );
+                    """
+
+GET_CACHED_EMBEDDING = "SELECT embedding, created FROM query_embeddings WHERE model = ? AND query = ?;"
+
+PUT_CACHED_EMBEDDING = "INSERT OR REPLACE INTO query_embeddings (model, query, embedding, created) VALUES (?, ?, ?, ?);"
+
+
+def normalize_query(text):
+    """
+    Normalize a query so trivially different spellings share a cache entry.
+
+    Parameters:
+    text (str): The query text.
+
+    Returns:
+    str: The NFC-normalized text with runs of whitespace collapsed to single spaces.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    """
+    Bounded LRU cache of query embeddings keyed on (model name, normalized query text), with an optional
+    SQLite tier on disk that several worker processes can share.
+    """
+
+    def __init__(self, model_name, max_size=10000, ttl=3600, path=None):
+        """
+        Parameters:
+        model_name (str): The model the cached embeddings belong to. Workers serving other models may share the disk
+        tier; the model is part of every key.
+        max_size (int): The number of embeddings kept in memory.
+        ttl (float): Seconds an entry stays valid, or 0 to keep entries until evicted.
+        path (str): Path of the shared SQLite file, or None for a memory-only cache.
+        """
+        self.model_name = model_name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _disk(self):
+        # sqlite3 connections cannot be shared between threads, so each thread opens its own
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL;")
+            connection.execute(CREATE_CACHE_TABLE)
+            self._local.connection = connection
+        return connection
+
+    def _expired(self, created):
+        return self.ttl > 0 and time.time() - created > self.ttl
+
+    def _remember(self, key, embedding, created):
+        with self._lock:
+            self._entries[key] = (embedding, created)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, model_name, query):
+        """
+        Look up a cached query embedding in memory, then on disk.
+
+        Parameters:
+        model_name (str): The model the embedding must come from.
+        query (str): The query text.
+
+        Returns:
+        List[float]: The cached embedding, or None on a miss.
+        """
+        embedding = self.get_memory(model_name, query)
+        if embedding is None:
+            embedding = self.get_disk(model_name, query)
+        return embedding
+
+    def get_memory(self, model_name, query):
+        """
+        Look up a cached query embedding in memory only. Never blocks on I/O, so it is safe on the event loop.
+        A miss is not counted; follow it with get_disk.
+
+        Parameters:
+        model_name (str): The model the embedding must come from.
+        query (str): The query text.
+
+        Returns:
+        List[float]: The cached embedding, or None if it is not in memory.
+        """
+        key = (model_name, normalize_query(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[1]):
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[0]
+                del self._entries[key]
+        return None
+
+    def get_disk(self, model_name, query):
+        """
+        Look up a cached query embedding in the SQLite tier, which can block on disk and on other workers' writes.
+
+        Parameters:
+        model_name (str): The model the embedding must come from.
+        query (str): The query text.
+
+        Returns:
+        List[float]: The cached embedding, or None on a miss.
+        """
+        key = (model_name, normalize_query(query))
+        if self.path:
+            row = self._disk().execute(GET_CACHED_EMBEDDING, key).fetchone()
+            if row is not None and not self._expired(row[1]):
+                embedding = np.frombuffer(row[0], dtype=np.float32).tolist()
+                self._remember(key, embedding, row[1])
+                with self._lock:
+                    self.disk_hits += 1
+                return embedding
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, model_name, query, embedding):
+        """
+        Store a query embedding in memory and on disk.
+
+        Parameters:
+        model_name (str): The model that produced the embedding.
+        query (str): The query text.
+        embedding (List[float]): The embedding to cache.
+
+        Returns:
+        None
+        """
+        created = time.time()
+        self.put_memory(model_name, query, embedding, created)
+        self.put_disk(model_name, query, embedding, created)
+
+    def put_memory(self, model_name, query, embedding, created=None):
+        """
+        Store a query embedding in memory only.
+
+        Parameters:
+        model_name (str): The model that produced the embedding.
+        query (str): The query text.
+        embedding (List[float]): The embedding to cache.
+        created (float): The creation time of the entry, defaults to now.
+
+        Returns:
+        None
+        """
+        self._remember((model_name, normalize_query(query)), embedding, time.time() if created is None else created)
+
+    def put_disk(self, model_name, query, embedding, created=None):
+        """
+        Store a query embedding in the SQLite tier, if there is one.
+
+        Parameters:
+        model_name (str): The model that produced the embedding.
+        query (str): The query text.
+        embedding (List[float]): The embedding to cache.
+        created (float): The creation time of the entry, defaults to now.
+
+        Returns:
+        None
+        """
+        key = (model_name, normalize_query(query))
+        created = time.time() if created is None else created
+        if self.path:
+            connection = self._disk()
+            blob = np.asarray(embedding, dtype=np.float32).tobytes()
+            connection.execute(PUT_CACHED_EMBEDDING, (*key, blob, created))
+            connection.commit()
+
+    def clear(self):
+        """
+        Drop every in-memory entry and reset the counters.
+
+        Parameters:
+        None
+
+        Returns:
+        None
+        """
+        with self._lock:
+            self._entries.clear()
+            self.memory_hits = self.disk_hits = self.misses = 0
+
+    def stats(self):
+        """
+        Report cache effectiveness.
+
+        Parameters:
+        None
+
+        Returns:
+        Dict: The number of entries held in memory and the memory hit, disk hit and miss counts.
+        """
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
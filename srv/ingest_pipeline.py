@@ -0,0 +1,337 @@
+import hashlib
+import io
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+
+import numpy as np
+from tqdm import tqdm
+
+from db.vector_store import get_vector_store
+from srv.chunkers import chunk_settings
+from srv.document_encoder import document_encoder
+from srv.ebook_services import MODEL_NAME
+from srv.ebook_services import chunk_document
+from srv.ebook_services import chunk_store
+from srv.ebook_services import document_encoder_stats
+from srv.ebook_services import document_title
+from srv.ebook_services import mark_corpus_changed
+from srv.ebook_services import replace_document
+from srv.model_registry import use_model
+from utils.epub2txt import epub_to_text
+from utils.pdf2txt import pdf_to_text
+
+SUPPORTED_EXTENSIONS = (".epub", ".pdf", ".txt")
+# Documents allowed to wait between two stages; bounds memory when one stage is slower than the others
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+# Chunks gathered across waiting documents before the encoder stage runs a batch
+PIPELINE_ENCODE_BATCH = int(os.getenv("PIPELINE_ENCODE_BATCH", "256"))
+# Syncing at least this many new files switches to bulk-load mode; 0 only uses it when asked for
+BULK_LOAD_MIN_FILES = int(os.getenv("BULK_LOAD_MIN_FILES", "0"))
+
+_DONE = object()
+
+
+class StageStats:
+    """
+    Throughput counters for one pipeline stage.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.documents = 0
+        self.chunks = 0
+        self.reused = 0
+        self.busy_seconds = 0.0
+
+    def record(self, seconds, documents=1, chunks=0, reused=0):
+        self.documents += documents
+        self.chunks += chunks
+        self.reused += reused
+        self.busy_seconds += seconds
+
+    def report(self, elapsed):
+        reused = f" ({self.reused} reused)" if self.reused else ""
+        return (
+            f"{self.name}: {self.documents} documents, {self.chunks} chunks{reused}, {self.busy_seconds:.1f}s busy, "
+            f"{self.documents / elapsed:.2f} documents/s, {self.chunks / elapsed:.1f} chunks/s"
+        )
+
+
+class _Document:
+    """
+    A source file as it moves through the pipeline.
+    """
+
+    def __init__(self, path, title, text, content_hash, reuse_embeddings):
+        self.path = path
+        self.title = title
+        self.text = text
+        self.content_hash = content_hash
+        self.reuse_embeddings = reuse_embeddings
+        self.chunks = None
+        self.chunk_offsets = None
+        self.embeddings = None
+        self.missing = None
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _extract(path, known_hash=None):
+    """
+    Hash a document and, unless it matches the hash already ingested, extract its text in a worker process.
+
+    Parameters:
+    path (str): The absolute path to an .epub, .pdf or .txt file.
+    known_hash (str): The content hash recorded when the file was last ingested, or None.
+
+    Returns:
+    Tuple[str, str, str, float]: The title the document is stored under and its text (both None if the file is
+    unchanged), its content hash and the seconds spent.
+    """
+    started = time.perf_counter()
+    if path.endswith(".txt"):
+        # Hashed and decoded from the same read, with the newline translation of text mode
+        with open(path, "rb") as f:
+            data = f.read()
+        content_hash = hashlib.sha256(data).hexdigest()
+        if content_hash == known_hash:
+            return None, None, content_hash, time.perf_counter() - started
+        text = io.StringIO(data.decode("utf-8"), newline=None).read()
+        return document_title(path), text, content_hash, time.perf_counter() - started
+    content_hash = _file_digest(path)
+    if content_hash == known_hash:
+        return None, None, content_hash, time.perf_counter() - started
+    # Files are already extracted in parallel, so each book is parsed by a single worker
+    if path.endswith(".epub"):
+        text = epub_to_text(path, workers=1)
+    else:
+        text = pdf_to_text(path, workers=1)
+    return document_title(path), text, content_hash, time.perf_counter() - started
+
+
+def _drain(in_queue):
+    # Keep consuming after a failure so upstream stages never block on a full queue
+    while in_queue.get() is not _DONE:
+        pass
+
+
+def _prepare_embeddings(document, model, dimensions):
+    """
+    Chunk a document and fill in the embeddings of chunks whose text is unchanged since the last ingest.
+    """
+    document.chunks, document.chunk_offsets = chunk_document(document.text, model)
+    document.embeddings = np.zeros((len(document.chunks), dimensions), dtype=np.float32)
+    known = {}
+    if document.reuse_embeddings:
+        known = {chunk: embedding for chunk, embedding in get_vector_store().book_chunk_embeddings(document.title)}
+    document.missing = []
+    for i, chunk in enumerate(document.chunks):
+        if chunk in known:
+            document.embeddings[i] = known[chunk]
+        else:
+            document.missing.append(i)
+
+
+def _encode_stage(in_queue, out_queue, stats, errors, batch_size):
+    try:
+        with use_model(MODEL_NAME) as model:
+            dimensions = model.get_sentence_embedding_dimension()
+            encode = document_encoder(model)
+            pending = []
+            done = False
+            while not done:
+                document = in_queue.get()
+                if document is _DONE:
+                    done = True
+                else:
+                    _prepare_embeddings(document, model, dimensions)
+                    pending.append(document)
+                pending_chunks = sum(len(document.missing) for document in pending)
+                if pending and (done or pending_chunks >= batch_size or in_queue.empty()):
+                    started = time.perf_counter()
+                    to_encode = [document.chunks[i] for document in pending for i in document.missing]
+                    if to_encode:
+                        embeddings = chunk_store.embed(to_encode, encode)
+                        offset = 0
+                        for document in pending:
+                            document.embeddings[document.missing] = embeddings[offset : offset + len(document.missing)]
+                            offset += len(document.missing)
+                    total_chunks = sum(len(document.chunks) for document in pending)
+                    stats.record(time.perf_counter() - started, len(pending), total_chunks, total_chunks - len(to_encode))
+                    for document in pending:
+                        out_queue.put(document)
+                    pending = []
+    except Exception as e:
+        errors.append(e)
+        _drain(in_queue)
+    finally:
+        out_queue.put(_DONE)
+
+
+def _write_stage(in_queue, stats, errors, progress_bar):
+    try:
+        while True:
+            document = in_queue.get()
+            if document is _DONE:
+                return
+            started = time.perf_counter()
+            replace_document(document.title, document.text, document.chunks, document.embeddings, document.chunk_offsets)
+            get_vector_store().upsert_manifest_entry(
+                document.path, document.title, document.content_hash, MODEL_NAME, *chunk_settings()
+            )
+            stats.record(time.perf_counter() - started, 1, len(document.chunks))
+            progress_bar.set_description(f"Stored {document.title}")
+            progress_bar.update(1)
+    except Exception as e:
+        errors.append(e)
+        _drain(in_queue)
+
+
+def _prune_removed(directory, paths, manifest):
+    """
+    Remove the books of files that were ingested from this directory but no longer exist.
+
+    Returns:
+    int: The number of books removed.
+    """
+    present = set(paths)
+    removed = 0
+    for source_path, (title, *_) in manifest.items():
+        if os.path.dirname(source_path) == directory and source_path not in present:
+            print(f"Removing {title}, its source {os.path.basename(source_path)} no longer exists")
+            get_vector_store().delete_book(title)
+            get_vector_store().delete_manifest_entry(source_path)
+            removed += 1
+    return removed
+
+
+def ingest_directory(directory, workers=1, prune=False, bulk=False):
+    """
+    Sync every supported file in a directory into the database through a staged pipeline and print per-stage throughput.
+    A process pool hashes and extracts text, one encoder thread embeds chunks from several documents per batch, and one
+    writer thread COPYs each document into the database. Stages are connected by queues of PIPELINE_QUEUE_SIZE documents.
+
+    An ingestion manifest records the content hash, model and chunk parameters of every file. Files that have not
+    changed since they were last ingested are skipped, and when a changed file is re-ingested with the same model only
+    chunks whose text changed are re-embedded.
+
+    In bulk-load mode the vector store defers index maintenance until the load is done; for pgvector the chunk index
+    is dropped and then rebuilt CONCURRENTLY, so searches keep working, unindexed, in the meantime.
+
+    Parameters:
+    directory (str): The directory containing .epub, .pdf and .txt files.
+    workers (int): The number of extraction processes.
+    prune (bool): Whether to remove books whose source file was ingested from this directory and has since been deleted.
+    bulk (bool): Whether to use bulk-load mode. It is also used when at least BULK_LOAD_MIN_FILES files are new.
+
+    Returns:
+    List[StageStats]: The throughput counters of the extract, encode and write stages.
+    """
+    directory = os.path.abspath(directory)
+    paths = [os.path.join(directory, file) for file in sorted(os.listdir(directory)) if file.endswith(SUPPORTED_EXTENSIONS)]
+    manifest = get_vector_store().manifest_entries()
+    removed = _prune_removed(directory, paths, manifest) if prune else 0
+    new_files = sum(path not in manifest for path in paths)
+    bulk = bulk or (BULK_LOAD_MIN_FILES > 0 and new_files >= BULK_LOAD_MIN_FILES)
+    if bulk:
+        print(f"Bulk-loading {new_files} new files, index maintenance is deferred")
+        get_vector_store().begin_bulk_load()
+
+    extract_stats = StageStats("extract")
+    encode_stats = StageStats("encode")
+    write_stats = StageStats("write")
+    skipped = 0
+    pruned = 0
+    errors = []
+    extracted = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    encoded = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    progress_bar = tqdm(total=len(paths), desc="Processing files", unit="file")
+
+    encoder = threading.Thread(
+        target=_encode_stage, args=(extracted, encoded, encode_stats, errors, PIPELINE_ENCODE_BATCH), daemon=True
+    )
+    writer = threading.Thread(target=_write_stage, args=(encoded, write_stats, errors, progress_bar), daemon=True)
+    encoder.start()
+    writer.start()
+
+    started = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            remaining = iter(paths)
+            in_flight = {}
+            while True:
+                # Only keep a few extractions ahead of the encoder so finished texts do not pile up in memory
+                while len(in_flight) < workers + PIPELINE_QUEUE_SIZE and not errors:
+                    path = next(remaining, None)
+                    if path is None:
+                        break
+                    entry = manifest.get(path)
+                    same_model = entry is not None and entry[2] == MODEL_NAME
+                    unchanged_settings = same_model and tuple(entry[3:]) == chunk_settings()
+                    known_hash = entry[1] if unchanged_settings else None
+                    in_flight[pool.submit(_extract, path, known_hash)] = (path, same_model)
+                if not in_flight:
+                    break
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    path, same_model = in_flight.pop(future)
+                    try:
+                        title, text, content_hash, seconds = future.result()
+                    except Exception as e:
+                        progress_bar.write(f"Skipping {os.path.basename(path)}: {e}")
+                        progress_bar.update(1)
+                        continue
+                    if title is None:
+                        skipped += 1
+                        progress_bar.update(1)
+                        continue
+                    extract_stats.record(seconds)
+                    extracted.put(_Document(path, title, text, content_hash, same_model))
+    finally:
+        extracted.put(_DONE)
+        encoder.join()
+        writer.join()
+        progress_bar.close()
+        if bulk:
+            get_vector_store().end_bulk_load()
+        if write_stats.documents or removed:
+            mark_corpus_changed()
+            # Replaced and removed books leave embeddings in the chunk store that nothing references
+            pruned = chunk_store.prune()
+
+    if errors:
+        raise errors[0]
+
+    elapsed = time.perf_counter() - started
+    stage_stats = [extract_stats, encode_stats, write_stats]
+    print(f"Ingested {write_stats.documents} documents in {elapsed:.1f}s, {skipped} unchanged, {removed} removed")
+    for stats in stage_stats:
+        print(stats.report(elapsed))
+    model_stats = document_encoder_stats()
+    print(
+        f"model: {model_stats['tokens']} tokens in {model_stats['batches']} batches, "
+        f"{model_stats['tokens_per_second']:.0f} tokens/s, padding efficiency {model_stats['padding_efficiency']:.1%}"
+    )
+    store_stats = chunk_store.stats()
+    print(
+        f"chunk store: {store_stats['duplicates']} duplicate and {store_stats['store_hits']} stored chunks reused, "
+        f"{store_stats['encoded']} encoded, dedup ratio {store_stats['dedup_ratio']:.1%}"
+    )
+    storage = chunk_store.storage()
+    if storage:
+        print(
+            f"chunk store: {pruned} orphaned embeddings pruned, {storage['rows']} stored in "
+            f"{storage['store_bytes'] / 2**20:.1f} MB, {storage['overhead_ratio']:.1%} on top of the chunk table"
+        )
+    return stage_stats
@@ -0,0 +1,209 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from sentence_transformers import SentenceTransformer
+
+MODEL_DEVICE = os.getenv("MODEL_DEVICE") or None
+MODEL_DTYPE = os.getenv("MODEL_DTYPE") or None
+MAX_LOADED_MODELS = int(os.getenv("MAX_LOADED_MODELS", "2"))
+
+# (name, device, dtype) -> _ModelEntry, least recently used first
+_models = OrderedDict()
+_models_lock = threading.Lock()
+_load_locks = {}
+
+
+class _ModelEntry:
+    def __init__(self, model):
+        self.model = model
+        self.in_use = 0
+        self.last_used = time.monotonic()
+
+
+def _model_key(name, device=None, dtype=None):
+    return (name, device or MODEL_DEVICE, dtype or MODEL_DTYPE)
+
+
+def _load_model(name, device, dtype):
+    """
+    Load a sentence transformer model from disk or the Hugging Face hub.
+
+    Parameters:
+    name (str): The name of the model.
+    device (str): The device to load the model onto, or None to let the library choose.
+    dtype (str): The torch dtype name to load the weights as (e.g. "float16"), or None for the default.
+
+    Returns:
+    SentenceTransformer: The loaded model.
+    """
+    model_kwargs = None
+    if dtype:
+        import torch
+
+        model_kwargs = {"torch_dtype": getattr(torch, dtype)}
+    return SentenceTransformer(name, device=device, model_kwargs=model_kwargs)
+
+
+def _evict_unused_locked(keep=None):
+    """
+    Evict least recently used models that are not in use until the registry fits MAX_LOADED_MODELS.
+    Must be called with _models_lock held.
+
+    Parameters:
+    keep (Tuple[str, str, str]): The key of a model that must not be evicted, such as the one just loaded.
+    """
+    for key in list(_models.keys()):
+        if len(_models) <= MAX_LOADED_MODELS:
+            break
+        if key != keep and _models[key].in_use == 0:
+            del _models[key]
+
+
+def _get_entry(key, acquire=False):
+    """
+    Get the registry entry of a model, loading it at most once per process.
+
+    Parameters:
+    key (Tuple[str, str, str]): The (name, device, dtype) key of the model.
+    acquire (bool): Whether to mark the entry in use, under the same lock that found or inserted it, so it cannot be
+    evicted before the caller holds it.
+
+    Returns:
+    _ModelEntry: The entry of the model.
+    """
+    with _models_lock:
+        entry = _models.get(key)
+        if entry is not None:
+            _models.move_to_end(key)
+            entry.last_used = time.monotonic()
+            entry.in_use += acquire
+            return entry
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+
+    # Load outside the registry lock so other models stay available while this one loads
+    with load_lock:
+        with _models_lock:
+            entry = _models.get(key)
+            if entry is not None:
+                _models.move_to_end(key)
+                entry.in_use += acquire
+                return entry
+        model = _load_model(*key)
+        with _models_lock:
+            entry = _ModelEntry(model)
+            entry.in_use += acquire
+            _models[key] = entry
+            _evict_unused_locked(keep=key)
+    return entry
+
+
+def get_model(name, device=None, dtype=None):
+    """
+    Get a sentence transformer model, loading it at most once per process.
+
+    Parameters:
+    name (str): The name of the model.
+    device (str): The device to load the model onto. Defaults to MODEL_DEVICE.
+    dtype (str): The torch dtype name to load the weights as. Defaults to MODEL_DTYPE.
+
+    Returns:
+    SentenceTransformer: The shared model instance.
+    """
+    return _get_entry(_model_key(name, device, dtype)).model
+
+
+@contextmanager
+def use_model(name, device=None, dtype=None):
+    """
+    Context manager that yields a shared model and protects it from eviction while in use.
+
+    Parameters:
+    name (str): The name of the model.
+    device (str): The device to load the model onto. Defaults to MODEL_DEVICE.
+    dtype (str): The torch dtype name to load the weights as. Defaults to MODEL_DTYPE.
+
+    Yields:
+    SentenceTransformer: The shared model instance.
+    """
+    entry = _get_entry(_model_key(name, device, dtype), acquire=True)
+    try:
+        yield entry.model
+    finally:
+        with _models_lock:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            _evict_unused_locked()
+
+
+def warm_models(names, device=None, dtype=None):
+    """
+    Load the given models ahead of time and run a dummy encode so the first request does not pay for it.
+
+    Parameters:
+    names (List[str]): The names of the models to load.
+    device (str): The device to load the models onto. Defaults to MODEL_DEVICE.
+    dtype (str): The torch dtype name to load the weights as. Defaults to MODEL_DTYPE.
+
+    Returns:
+    None
+    """
+    for name in names:
+        get_model(name, device, dtype).encode(["warmup"])
+
+
+def evict_model(name, device=None, dtype=None):
+    """
+    Remove a model from the registry if it is not currently in use.
+
+    Parameters:
+    name (str): The name of the model.
+    device (str): The device the model was loaded onto. Defaults to MODEL_DEVICE.
+    dtype (str): The torch dtype the model was loaded as. Defaults to MODEL_DTYPE.
+
+    Returns:
+    bool: True if the model was evicted.
+    """
+    key = _model_key(name, device, dtype)
+    with _models_lock:
+        entry = _models.get(key)
+        if entry is None or entry.in_use > 0:
+            return False
+        del _models[key]
+    return True
+
+
+def evict_idle_models(max_idle_seconds):
+    """
+    Remove every model that is not in use and has not been used for the given number of seconds.
+
+    Parameters:
+    max_idle_seconds (float): How long a model may sit unused before it is evicted.
+
+    Returns:
+    List[Tuple[str, str, str]]: The (name, device, dtype) keys of the evicted models.
+    """
+    now = time.monotonic()
+    evicted = []
+    with _models_lock:
+        for key, entry in list(_models.items()):
+            if entry.in_use == 0 and now - entry.last_used >= max_idle_seconds:
+                del _models[key]
+                evicted.append(key)
+    return evicted
+
+
+def loaded_models():
+    """
+    List the models currently held by the registry.
+
+    Parameters:
+    None
+
+    Returns:
+    List[Tuple[str, str, str]]: The (name, device, dtype) keys of the loaded models, least recently used first.
+    """
+    with _models_lock:
+        return list(_models.keys())
@@ -0,0 +1,100 @@
+import copy
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of search results tagged with the corpus generation they were computed against.
+    An entry is only returned while the corpus is still at that generation.
+    Results are copied on the way in and out, so callers may modify what they get without corrupting the cache.
+    """
+
+    def __init__(self, max_size=1000):
+        """
+        Parameters:
+        max_size (int): The number of result lists to keep.
+        """
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get(self, key, generation):
+        """
+        Look up cached results.
+
+        Parameters:
+        key (Hashable): The search parameters.
+        generation (int): The current corpus generation.
+
+        Returns:
+        List[Dict]: The cached results, or None if there are none for this generation.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] != generation:
+                del self._entries[key]
+                self.stale += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def put(self, key, generation, results):
+        """
+        Store search results.
+
+        Parameters:
+        key (Hashable): The search parameters.
+        generation (int): The corpus generation the results were computed against.
+        results (List[Dict]): The results to cache.
+
+        Returns:
+        None
+        """
+        results = copy.deepcopy(results)
+        with self._lock:
+            self._entries[key] = (generation, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Drop every cached result.
+
+        Parameters:
+        None
+
+        Returns:
+        None
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Report cache effectiveness.
+
+        Parameters:
+        None
+
+        Returns:
+        Dict: The number of cached result lists and the hit, miss and stale counts.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,55 @@
+import asyncio
+import threading
+
+from srv.batcher import MicroBatcher
+
+
+def test_timed_out_request_does_not_stop_the_worker():
+    release = threading.Event()
+
+    def process_batch(items):
+        if "slow" in items:
+            release.wait(5)
+        return [item.upper() for item in items]
+
+    batcher = MicroBatcher(process_batch, max_batch=4, max_wait=0.001)
+
+    async def requests():
+        with_timeout = asyncio.wait_for(asyncio.wrap_future(batcher.submit("slow")), timeout=0.05)
+        try:
+            await with_timeout
+        except asyncio.TimeoutError:
+            pass
+        # The batch that held the cancelled future finishes after its caller gave up
+        release.set()
+        return await asyncio.wait_for(asyncio.wrap_future(batcher.submit("next")), timeout=5)
+
+    assert asyncio.run(requests()) == "NEXT"
+    assert batcher._worker.is_alive()
+
+
+def test_cancelled_future_is_skipped():
+    batcher = MicroBatcher(lambda items: items, max_batch=4, max_wait=0.05)
+    cancelled = batcher.submit("cancelled")
+    assert cancelled.cancel()
+    assert batcher.submit("kept").result(timeout=5) == "kept"
+    assert batcher._worker.is_alive()
+
+
+def test_failing_batch_does_not_stop_the_worker():
+    def process_batch(items):
+        if "bad" in items:
+            raise ValueError("bad item")
+        return items
+
+    batcher = MicroBatcher(process_batch, max_batch=1, max_wait=0.001)
+    failed = batcher.submit("bad")
+    assert isinstance(failed.exception(timeout=5), ValueError)
+    assert batcher.submit("good").result(timeout=5) == "good"
+    assert batcher._worker.is_alive()
+
+
+def test_short_result_sequence_fails_the_batch():
+    batcher = MicroBatcher(lambda items: [], max_batch=1, max_wait=0.001)
+    assert isinstance(batcher.submit("x").exception(timeout=5), ValueError)
+    assert batcher._worker.is_alive()
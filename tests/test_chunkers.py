@@ -0,0 +1,80 @@
+import re
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from srv.chunkers import CharacterChunker
+from srv.chunkers import Chunker
+from srv.chunkers import TokenChunker
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+TEXT = (
+    "\n\n".join(
+        " ".join(
+            f"Sentence {paragraph}.{sentence} has {'quite a few words ' * (sentence % 5)}in it."
+            for sentence in range(1 + paragraph % 7)
+        )
+        for paragraph in range(40)
+    )
+    + "\n\n"
+    + "An overlong sentence without a break " * 12
+    + "ends here. And a short last one"
+)
+
+
+class WordTokenizer:
+    """
+    Stands in for a fast tokenizer: one token per word or punctuation mark.
+    """
+
+    def __call__(self, text, add_special_tokens=True, return_offsets_mapping=False, **kwargs):
+        if isinstance(text, list):
+            return {"input_ids": [self(piece)["input_ids"] for piece in text]}
+        matches = list(_TOKEN.finditer(text))
+        encoded = {"input_ids": list(range(len(matches)))}
+        if return_offsets_mapping:
+            encoded["offset_mapping"] = [match.span() for match in matches]
+        return encoded
+
+
+def _streamed_spans(chunker, text, block_size):
+    # The loop srv.ebook_services._iter_chunk_windows runs over the blocks of a document
+    spans = []
+    buffer = ""
+    buffer_start = 0
+    blocks = [text[i : i + block_size] for i in range(0, len(text), block_size)]
+    for i, block in enumerate(blocks + [""]):
+        buffer += block
+        partial, carry = chunker.partial_spans(buffer, final=i == len(blocks))
+        spans.extend((buffer_start + start, buffer_start + end) for start, end in partial)
+        buffer = buffer[carry:]
+        buffer_start += carry
+    return spans
+
+
+@pytest.mark.parametrize(
+    "chunker",
+    [CharacterChunker(100, 20), CharacterChunker(64, 0), TokenChunker(WordTokenizer(), 24, 6, batch_size=7)],
+    ids=["characters", "characters-no-overlap", "tokens"],
+)
+@pytest.mark.parametrize("block_size", [1, 37, 500, len(TEXT)])
+def test_streamed_spans_match_whole_text(chunker, block_size):
+    assert _streamed_spans(chunker, TEXT, block_size) == chunker.spans(TEXT)
+
+
+def test_token_chunker_splits_overlong_sentences():
+    chunker = TokenChunker(WordTokenizer(), 24, 6)
+    spans = chunker.spans(TEXT)
+    assert all(len(_TOKEN.findall(TEXT[start:end])) <= 24 for start, end in spans)
+    assert spans[-1][1] == len(TEXT)
+
+
+def test_chunker_requires_partial_spans_and_settings():
+    class Incomplete(Chunker):
+        def settings(self):
+            return 0, 0, "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -1,44 +1,142 @@
 import ebooklib
 from ebooklib import epub
-from bs4 import BeautifulSoup
+import lxml.html
+from lxml.etree import ParserError
 import os
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional
 
-def epub2txt(epub_path):
+# Threads parsing the chapters of one EPUB; lxml releases the GIL while it parses, but not while it extracts the
+# text, so only parsing runs in parallel. 0 uses up to 8.
+EPUB_WORKERS = int(os.getenv('EPUB_WORKERS', '0'))
+
+# Elements whose text is not part of the book
+_SKIPPED_TAGS = ('script', 'style', 'head')
+_HEADING_TAGS = ('h1', 'h2', 'h3')
+
+# lxml locks a parser while it is in use, so threads sharing lxml.html's default one would parse one at a time
+_parsers = threading.local()
+
+class Chapter(NamedTuple):
     """
-    Convert an EPUB file to text format.
+    A chapter of an EPUB, in spine order.
+    
+    Attributes:
+        index (int): Position of the chapter among the chapters that have text
+        href (str): Name of the chapter's document inside the EPUB
+        title (Optional[str]): Text of the chapter's first heading, or its <title>
+        text (str): Text of the chapter with whitespace collapsed
+        offset (int): Position of the chapter's text in the text returned by epub_to_text
+    """
+    index: int
+    href: str
+    title: Optional[str]
+    text: str
+    offset: int
+
+def _parse_chapter(html_content: bytes):
+    """
+    Extract the title and whitespace-collapsed text of one EPUB document with lxml.
+    
+    Args:
+        html_content (bytes): The XHTML of the document
+        
+    Returns:
+        Tuple[Optional[str], str]: The chapter title and text
+    """
+    parser = getattr(_parsers, 'parser', None)
+    if parser is None:
+        parser = _parsers.parser = lxml.html.HTMLParser()
+    try:
+        root = lxml.html.fromstring(html_content, parser=parser)
+    except ParserError:
+        # Raised for documents without any content
+        return None, ''
+    
+    title = None
+    for heading in root.iter(*_HEADING_TAGS):
+        title = ' '.join(heading.text_content().split()) or None
+        if title:
+            break
+    if title is None:
+        title = ' '.join(root.findtext('.//title', '').split()) or None
+    
+    for element in list(root.iter(*_SKIPPED_TAGS)):
+        element.drop_tree()
+    return title, ' '.join(root.text_content().split())
+
+def _spine_documents(book):
+    # Reading order is the spine; books without one fall back to manifest order
+    documents = []
+    for idref, _ in book.spine:
+        item = book.get_item_with_id(idref)
+        if item is not None and item.get_type() == ebooklib.ITEM_DOCUMENT:
+            documents.append(item)
+    return documents or list(book.get_items_of_type(ebooklib.ITEM_DOCUMENT))
+
+def epub_chapters(epub_path: str, workers: int = EPUB_WORKERS) -> List[Chapter]:
+    """
+    Extract the chapters of an EPUB file in spine order, parsing them in parallel.
     
     Args:
         epub_path (str): Path to the EPUB file
+        workers (int): Number of parsing threads, 0 for up to 8, 1 to parse in this thread
         
     Returns:
-        str: Filename of the generated text file
+        List[Chapter]: Every chapter that has text, with its offset in the text returned by epub_to_text
     """
     # Read EPUB file
     book = epub.read_epub(epub_path)
+    documents = _spine_documents(book)
+    contents = [item.get_content() for item in documents]
     
-    # Storage for extracted text
-    chapters = []
+    workers = min(workers or min(8, os.cpu_count() or 1), max(1, len(contents)))
+    if workers <= 1:
+        parsed = [_parse_chapter(content) for content in contents]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            parsed = list(pool.map(_parse_chapter, contents))
     
-    # Iterate through all items in the EPUB
-    for item in book.get_items():
-        # We're only interested in HTML content (the text of the book)
-        if item.get_type() == ebooklib.ITEM_DOCUMENT:
-            # Get the content
-            html_content = item.get_content()
+    chapters: List[Chapter] = []
+    offset = 0
+    for item, (title, text) in zip(documents, parsed):
+        # Keep only chapters with actual content
+        if not text:
+            continue
+        if chapters:
+            offset += 2
+        chapters.append(Chapter(len(chapters), item.get_name(), title, text, offset))
+        offset += len(text)
+    return chapters
 
-            # Parse HTML using BeautifulSoup
-            soup = BeautifulSoup(html_content, 'html.parser')
-            
-            # Get text content and remove extra whitespace
-            text = ' '.join(soup.get_text().split())
-            
-            # Add to chapters if there's actual content
-            if text.strip():
-                chapters.append(text)
+def epub_to_text(epub_path: str, workers: int = EPUB_WORKERS) -> str:
+    """
+    Extract the text of an EPUB file without writing it to disk.
     
+    Args:
+        epub_path (str): Path to the EPUB file
+        workers (int): Number of parsing threads, 0 for up to 8
+        
+    Returns:
+        str: The text of every chapter that has any, in spine order, separated by blank lines
+    """
     # Join all chapters with newlines
-    text_content = '\n\n'.join(chapters)
+    return '\n\n'.join(chapter.text for chapter in epub_chapters(epub_path, workers))
+
+def epub2txt(epub_path, workers=EPUB_WORKERS):
+    """
+    Convert an EPUB file to text format.
+    
+    Args:
+        epub_path (str): Path to the EPUB file
+        workers (int): Number of parsing threads, 0 for up to 8
+        
+    Returns:
+        str: Filename of the generated text file
+    """
+    text_content = epub_to_text(epub_path, workers)
     txt_filename = os.path.splitext(os.path.basename(epub_path))[0] + '.txt'
     with open(txt_filename, 'w', encoding='utf-8') as f:
         f.write(text_content)
@@ -60,6 +158,12 @@ Examples:
         '-f', '--file',
         help='EPUB file to convert'
     )
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=EPUB_WORKERS,
+        help='Number of threads parsing chapters, 0 for up to 8'
+    )
 
     # Parse arguments
     args = parser.parse_args()
@@ -69,7 +173,7 @@ Examples:
         # Convert single file
         if not os.path.isfile(args.file):
             parser.error(f"Input file does not exist: {args.file}")
-        text_file = epub2txt(args.file)
+        epub2txt(args.file, args.workers)
     else:
         parser.error("Please provide either a file or directory to convert")
 
@@ -1,41 +1,148 @@
 import pdfplumber
+import pypdfium2 as pdfium
 import os
 import argparse
-from typing import Optional, List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List
 
-def pdf2txt(pdf_path: str) -> str:
+# "pdfplumber" runs layout analysis on every page; "pypdfium2" reads the text layer directly and is much faster
+PDF_BACKENDS = ('pdfplumber', 'pypdfium2')
+PDF_BACKEND = os.getenv('PDF_BACKEND', 'pdfplumber')
+# Processes extracting pages of one PDF; 0 uses every CPU
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', '0'))
+# Pages handed to a worker at a time
+PDF_PAGES_PER_SHARD = int(os.getenv('PDF_PAGES_PER_SHARD', '16'))
+
+def _count_pages(pdf_path: str) -> int:
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+def _extract_pages(pdf_path: str, start: int, end: int, backend: str) -> List[str]:
     """
-    Convert a PDF file to text format.
+    Extract the text of pages start to end - 1 of a PDF file.
     
     Args:
         pdf_path (str): Path to the PDF file
+        start (int): Index of the first page
+        end (int): Index after the last page
+        backend (str): One of PDF_BACKENDS
         
     Returns:
-        str: Filename of the generated text file
+        List[str]: The stripped text of each page, empty for pages without text
     """
-    # Storage for extracted text
     pages_text: List[str] = []
+    if backend == 'pdfplumber':
+        with pdfplumber.open(pdf_path, pages=range(start + 1, end + 1)) as pdf:
+            for page in pdf.pages:
+                pages_text.append((page.extract_text() or '').strip())
+                # pdfplumber caches the parsed layout of every page until it is closed
+                page.close()
+        return pages_text
+
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        for index in range(start, end):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            pages_text.append(textpage.get_text_range().replace('\r\n', '\n').strip())
+            textpage.close()
+            page.close()
+    finally:
+        pdf.close()
+    return pages_text
+
+def iter_pdf_pages(pdf_path: str, backend: str = PDF_BACKEND, workers: int = PDF_WORKERS,
+                   pages_per_shard: int = PDF_PAGES_PER_SHARD) -> Iterator[str]:
+    """
+    Extract the text of a PDF file page by page, yielding pages as soon as they and every page before them are done.
+    Page ranges of pages_per_shard pages are extracted in parallel by a process pool and reassembled in order,
+    with at most two shards per worker in flight so memory use does not grow with the size of the book.
+    
+    Args:
+        pdf_path (str): Path to the PDF file
+        backend (str): One of PDF_BACKENDS
+        workers (int): Number of extraction processes, 0 for one per CPU, 1 to extract in this process
+        pages_per_shard (int): Number of pages extracted by a worker at a time
+        
+    Yields:
+        str: The stripped text of each page that has any, in page order
+    """
+    if backend not in PDF_BACKENDS:
+        raise ValueError(f'Unknown PDF backend: {backend}')
+    page_count = _count_pages(pdf_path)
+    shards = [(start, min(start + pages_per_shard, page_count)) for start in range(0, page_count, pages_per_shard)]
+    workers = min(workers or os.cpu_count() or 1, len(shards))
+    
+    if workers <= 1:
+        for start, end in shards:
+            yield from (text for text in _extract_pages(pdf_path, start, end, backend) if text)
+        return
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        remaining = iter(shards)
+        in_flight = []
+        for start, end in remaining:
+            in_flight.append(pool.submit(_extract_pages, pdf_path, start, end, backend))
+            if len(in_flight) >= 2 * workers:
+                break
+        while in_flight:
+            pages_text = in_flight.pop(0).result()
+            shard = next(remaining, None)
+            if shard is not None:
+                in_flight.append(pool.submit(_extract_pages, pdf_path, *shard, backend))
+            yield from (text for text in pages_text if text)
+
+def iter_pdf_text(pdf_path: str, backend: str = PDF_BACKEND, workers: int = PDF_WORKERS) -> Iterator[str]:
+    """
+    Stream the text of a PDF file as consecutive blocks that join into the text returned by pdf_to_text,
+    so it can be chunked and embedded while later pages are still being extracted.
     
-    # Open the PDF file
-    with pdfplumber.open(pdf_path) as pdf:
-        # Iterate through all pages
-        for page in pdf.pages:
-            # Extract text from the page
-            text = page.extract_text()
-            
-            # Add to pages if there's actual content
-            if text and text.strip():
-                pages_text.append(text.strip())
+    Args:
+        pdf_path (str): Path to the PDF file
+        backend (str): One of PDF_BACKENDS
+        workers (int): Number of extraction processes, 0 for one per CPU
+        
+    Yields:
+        str: The text of each page that has any, preceded by a blank line after the first
+    """
+    for i, text in enumerate(iter_pdf_pages(pdf_path, backend, workers)):
+        yield '\n\n' + text if i else text
+
+def pdf_to_text(pdf_path: str, backend: str = PDF_BACKEND, workers: int = PDF_WORKERS) -> str:
+    """
+    Extract the text of a PDF file without writing it to disk.
     
-    # Join all pages with newlines
-    text_content = '\n\n'.join(pages_text)
+    Args:
+        pdf_path (str): Path to the PDF file
+        backend (str): One of PDF_BACKENDS
+        workers (int): Number of extraction processes, 0 for one per CPU
+        
+    Returns:
+        str: The text of every page that has any, separated by blank lines
+    """
+    return ''.join(iter_pdf_text(pdf_path, backend, workers))
+
+def pdf2txt(pdf_path: str, backend: str = PDF_BACKEND, workers: int = PDF_WORKERS) -> str:
+    """
+    Convert a PDF file to text format.
     
+    Args:
+        pdf_path (str): Path to the PDF file
+        backend (str): One of PDF_BACKENDS
+        workers (int): Number of extraction processes, 0 for one per CPU
+        
+    Returns:
+        str: Filename of the generated text file
+    """
     # Create output filename
     txt_filename = os.path.splitext(os.path.basename(pdf_path))[0] + '.txt'
     
-    # Write to file
+    # Write pages as they are extracted
     with open(txt_filename, 'w', encoding='utf-8') as f:
-        f.write(text_content)
+        f.writelines(iter_pdf_text(pdf_path, backend, workers))
     
     return txt_filename
 
@@ -54,6 +161,18 @@ Examples:
         '-f', '--file',
         help='PDF file to convert'
     )
+    parser.add_argument(
+        '-b', '--backend',
+        choices=PDF_BACKENDS,
+        default=PDF_BACKEND,
+        help='Text extraction backend'
+    )
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=PDF_WORKERS,
+        help='Number of processes extracting pages, 0 for one per CPU'
+    )
 
     # Parse arguments
     args = parser.parse_args()
@@ -63,7 +182,7 @@ Examples:
         # Convert single file
         if not os.path.isfile(args.file):
             parser.error(f"Input file does not exist: {args.file}")
-        text_file = pdf2txt(args.file)
+        text_file = pdf2txt(args.file, args.backend, args.workers)
         print(f"Created text file: {text_file}")
     else:
         parser.error("Please provide a file to convert")